@@ -16,7 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .query import Database
-from .models import File, Annotation, Attributes
+from .models import File, Annotation, Attributes, CelebATable, preload
+from .alignment import FaceAlignment
 
 def get_config():
   """Returns a string containing the configuration information.
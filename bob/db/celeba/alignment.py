@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Batched, landmark-based face alignment for the CelebA images.
+
+All coordinates are given in ``(y,x)`` order, and all sizes in ``(height, width)`` order, as usual for Bob.
+Gray images are 2D arrays ``(H, W)``, color images are 3D arrays ``(C, H, W)``, and batches of images have an additional first dimension.
+"""
+
+
+def similarity_transforms(annotations, right_eye, left_eye):
+  """Computes the similarity transforms of a batch of images from the eye locations.
+
+  The returned transforms map the ``(y,x)`` coordinates of the aligned image to the ``(y,x)`` coordinates of the original image, i.e., ``(y',x') = T[:,:2] (y,x) + T[:,2]``, so that the given ``right_eye`` and ``left_eye`` positions in the aligned image are mapped to the annotated eye locations.
+
+  Keyword parameters:
+
+  ``annotations`` : array_like (B, 5, 2)
+    The annotations of the batch of images, as returned by :py:meth:`bob.db.celeba.Database.annotations_batch`.
+
+  ``right_eye``, ``left_eye`` : (float, float)
+    The ``(y,x)`` locations of the right and left eye in the aligned image.
+
+  Returns the (B, 2, 3) array of transforms.
+  """
+  import numpy
+  annotations = numpy.asarray(annotations, dtype=numpy.float64)
+  # represent the points as complex numbers x + iy
+  source_right = annotations[:, 0, 1] + 1j * annotations[:, 0, 0]
+  source_left = annotations[:, 1, 1] + 1j * annotations[:, 1, 0]
+  target_right = right_eye[1] + 1j * right_eye[0]
+  target_left = left_eye[1] + 1j * left_eye[0]
+
+  # rotation and scale, and translation
+  a = (source_left - source_right) / (target_left - target_right)
+  b = source_right - a * target_right
+
+  transforms = numpy.empty((len(annotations), 2, 3))
+  transforms[:, 0, 0] = a.real
+  transforms[:, 0, 1] = a.imag
+  transforms[:, 0, 2] = b.imag
+  transforms[:, 1, 0] = -a.imag
+  transforms[:, 1, 1] = a.real
+  transforms[:, 1, 2] = b.real
+  return transforms
+
+
+def warp(images, transforms, size, fill = 0.):
+  """Warps a batch of images with the given transforms, using bilinear interpolation.
+
+  Keyword parameters:
+
+  ``images`` : array_like (B, H, W) or (B, C, H, W)
+    The batch of gray or color images, which all need to have the same size.
+
+  ``transforms`` : array_like (B, 2, 3)
+    The transforms from the coordinates of the warped image to the coordinates of the original image, see :py:func:`similarity_transforms`.
+
+  ``size`` : (int, int)
+    The ``(height, width)`` of the warped images.
+
+  ``fill`` : float
+    The value of the pixels that are mapped outside of the original image.
+
+  Returns the (B, height, width) or (B, C, height, width) array of warped images with type ``float64``.
+  """
+  import numpy
+  images = numpy.asarray(images)
+  transforms = numpy.asarray(transforms, dtype=numpy.float64)
+  color = images.ndim == 4
+  if color:
+    # move the color channels to the end for indexing
+    images = numpy.moveaxis(images, 1, -1)
+  batch, height, width = images.shape[:3]
+
+  # the source coordinates for all pixels of all warped images
+  y, x = numpy.mgrid[0:size[0], 0:size[1]].astype(numpy.float64)
+  t = transforms[:, :, :, None, None]
+  source_y = t[:, 0, 0] * y + t[:, 0, 1] * x + t[:, 0, 2]
+  source_x = t[:, 1, 0] * y + t[:, 1, 1] * x + t[:, 1, 2]
+
+  y0 = numpy.floor(source_y).astype(numpy.intp)
+  x0 = numpy.floor(source_x).astype(numpy.intp)
+  dy = source_y - y0
+  dx = source_x - x0
+  inside = (source_y >= 0) & (source_y <= height - 1) & (source_x >= 0) & (source_x <= width - 1)
+  y0 = numpy.clip(y0, 0, height - 1)
+  x0 = numpy.clip(x0, 0, width - 1)
+  y1 = numpy.minimum(y0 + 1, height - 1)
+  x1 = numpy.minimum(x0 + 1, width - 1)
+
+  b = numpy.arange(batch)[:, None, None]
+  if color:
+    dy, dx, inside = dy[..., None], dx[..., None], inside[..., None]
+  warped = (images[b, y0, x0] * (1. - dy) * (1. - dx) +
+            images[b, y0, x1] * (1. - dy) * dx +
+            images[b, y1, x0] * dy * (1. - dx) +
+            images[b, y1, x1] * dy * dx)
+  warped = numpy.where(inside, warped, fill)
+
+  if color:
+    warped = numpy.moveaxis(warped, -1, 1)
+  return warped
+
+
+class FaceAlignment:
+  """Crops and aligns batches of images to a fixed geometry, based on the eye locations of the annotations.
+
+  Keyword parameters:
+
+  ``crop_size`` : (int, int)
+    The ``(height, width)`` of the aligned images.
+
+  ``right_eye``, ``left_eye`` : (float, float)
+    The ``(y,x)`` locations of the right and left eye in the aligned images.
+
+  ``fill`` : float
+    The value of pixels that lie outside of the original image.
+  """
+
+  def __init__(self, crop_size = (80, 64), right_eye = (16, 15), left_eye = (16, 48), fill = 0.):
+    self.crop_size = tuple(crop_size)
+    self.right_eye = tuple(right_eye)
+    self.left_eye = tuple(left_eye)
+    self.fill = fill
+
+  def transforms(self, annotations):
+    """Returns the (B, 2, 3) transforms for the given (B, 5, 2) annotations, see :py:func:`similarity_transforms`"""
+    return similarity_transforms(annotations, self.right_eye, self.left_eye)
+
+  def __call__(self, images, annotations):
+    """Aligns the given batch of images with the given (B, 5, 2) annotations.
+
+    The ``images`` are either a (B, H, W) or (B, C, H, W) array, or a list of images.
+    Images of a list that differ in size are aligned one by one.
+
+    Returns the (B, height, width) or (B, C, height, width) array of aligned images.
+    """
+    import numpy
+    transforms = self.transforms(annotations)
+    if isinstance(images, numpy.ndarray) or len(set(numpy.shape(i) for i in images)) <= 1:
+      return warp(images, transforms, self.crop_size, self.fill)
+    return numpy.stack([warp(image[None], transform[None], self.crop_size, self.fill)[0] for image, transform in zip(images, transforms)])
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Random access to the original images inside the ``img_align_celeba.zip`` archive, without extracting it.
+
+The central directory of the archive is parsed once, and the position of the data of each image is stored in an index file, which contains the arrays:
+
+* ``ids``: the (N,) sorted file ids
+* ``offsets``: the (N,) offsets of the (compressed) image data in the archive
+* ``compressed_sizes``, ``sizes``: the (N,) compressed and uncompressed sizes of the images
+* ``methods``: the (N,) compression methods, which are either stored (``0``) or deflated (``8``)
+
+Afterwards, each image is read with a single positioned read.
+"""
+
+import os
+import io
+import struct
+
+import numpy
+
+# increase this number whenever the layout of the index changes
+index_version = 1
+
+_stored, _deflated = 0, 8
+_local_header = struct.Struct('<4s22xHH')
+
+
+def _default_index_file(filename):
+  """Returns the index file of the given archive in the cache directory, or ``None`` if the cache is disabled"""
+  from .models import cache_directory
+  if cache_directory is None:
+    return None
+  import hashlib
+  return os.path.join(cache_directory, 'archives', hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16] + '.npz')
+
+
+def build_index(filename):
+  """Parses the central directory of the given zip archive and the local headers of the images, and returns the arrays of the index.
+  Members that are not named by a file id, e.g., directories, are ignored."""
+  import zipfile
+  entries = []
+  with zipfile.ZipFile(filename) as archive:
+    for info in archive.infolist():
+      stem, extension = os.path.splitext(os.path.basename(info.filename))
+      if stem.isdigit() and extension:
+        entries.append((int(stem), info.header_offset, info.compress_size, info.file_size, info.compress_type))
+  # read the local headers in the order of the archive, as they might contain different extra fields than the central directory
+  entries.sort(key = lambda e: e[1])
+
+  offsets = numpy.empty(len(entries), dtype=numpy.int64)
+  fd = os.open(filename, os.O_RDONLY)
+  try:
+    for i, (_, header_offset, _, _, _) in enumerate(entries):
+      signature, name_length, extra_length = _local_header.unpack(os.pread(fd, _local_header.size, header_offset))
+      if signature != b'PK\x03\x04':
+        raise IOError("The zip archive '%s' contains an invalid local header at offset %d" % (filename, header_offset))
+      offsets[i] = header_offset + _local_header.size + name_length + extra_length
+  finally:
+    os.close(fd)
+
+  ids = numpy.array([e[0] for e in entries], dtype=numpy.int32)
+  order = numpy.argsort(ids, kind='mergesort')
+  if len(ids) and numpy.any(numpy.diff(ids[order]) == 0):
+    raise IOError("The zip archive '%s' contains several images with the same file id" % filename)
+  return {
+    'ids' : ids[order],
+    'offsets' : offsets[order],
+    'compressed_sizes' : numpy.array([e[2] for e in entries], dtype=numpy.int64)[order],
+    'sizes' : numpy.array([e[3] for e in entries], dtype=numpy.int64)[order],
+    'methods' : numpy.array([e[4] for e in entries], dtype=numpy.int16)[order],
+  }
+
+
+def _read_index(index_file, stat):
+  """Reads the given index file; returns ``None`` if it does not exist or was built from a different archive"""
+  try:
+    with numpy.load(index_file) as data:
+      if int(data['version']) != index_version or int(data['size']) != stat.st_size or float(data['mtime']) != stat.st_mtime:
+        return None
+      return {name : data[name] for name in ('ids', 'offsets', 'compressed_sizes', 'sizes', 'methods')}
+  except (IOError, OSError, ValueError, KeyError):
+    return None
+
+def _write_index(index_file, stat, index):
+  """Writes the given index atomically into the given index file; failures are logged, but otherwise ignored"""
+  from .cache import logger, _replace
+  try:
+    directory = os.path.dirname(index_file)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    _replace(index_file, lambda f: numpy.savez(f, version=index_version, size=stat.st_size, mtime=stat.st_mtime, **index))
+  except (IOError, OSError) as e:
+    logger.warning("Could not write the index of the zip archive to '%s': %s", index_file, e)
+
+
+class ImageArchive:
+  """Reads the original images from a zip archive, without extracting it.
+
+  The index of the archive (see :py:mod:`bob.db.celeba.archive`) is built at first use, and stored in the given ``index_file``.
+  Each image is read with a single :py:func:`os.pread` on a file descriptor, which is opened once per process and shared by all threads.
+  Archives are pickled by their file name, so that the workers of a process pool open each archive only once, see :py:func:`open_archive`.
+
+  Keyword parameters:
+
+  ``filename`` : str
+    The zip archive containing the images, which are named by their file id, e.g., ``img_align_celeba/000001.jpg``.
+    Stored and deflated images are supported.
+
+  ``index_file`` : str or ``None``
+    The file to store the index in; by default, the index is stored in the :py:data:`bob.db.celeba.models.cache_directory`, or not at all, if the cache is disabled.
+  """
+
+  def __init__(self, filename, index_file = None):
+    self.filename = filename
+    self.index_file = index_file if index_file is not None else _default_index_file(filename)
+    self._handle = None
+
+    stat = os.stat(filename)
+    index = _read_index(self.index_file, stat) if self.index_file is not None else None
+    if index is None:
+      index = build_index(filename)
+      if self.index_file is not None:
+        _write_index(self.index_file, stat, index)
+    for name, array in index.items():
+      setattr(self, name, array)
+
+  def __reduce__(self):
+    return (open_archive, (self.filename, self.index_file))
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, file_id):
+    position = numpy.searchsorted(self.ids, file_id)
+    return position < len(self.ids) and self.ids[position] == file_id
+
+  def _position(self, file_id):
+    position = int(numpy.searchsorted(self.ids, file_id))
+    if position == len(self.ids) or self.ids[position] != file_id:
+      raise KeyError(file_id)
+    return position
+
+  def _descriptor(self):
+    """Returns the file descriptor of this process, and opens it at first use"""
+    handle = self._handle
+    if handle is None or handle[0] != os.getpid():
+      from . import models
+      with models._lock:
+        handle = self._handle
+        if handle is None or handle[0] != os.getpid():
+          # descriptors inherited from a parent process are not closed, as the parent still uses them
+          handle = self._handle = (os.getpid(), os.open(self.filename, os.O_RDONLY))
+    return handle[1]
+
+  def close(self):
+    """Closes the file descriptor of this process; it is re-opened by the next read"""
+    handle, self._handle = self._handle, None
+    if handle is not None and handle[0] == os.getpid():
+      os.close(handle[1])
+
+  def size(self, file_id):
+    """Returns the (uncompressed) size of the image with the given file id"""
+    return int(self.sizes[self._position(file_id)])
+
+  def read(self, file_id):
+    """Returns the bytes of the image with the given file id; raises a :py:class:`KeyError` if the image is not contained in the archive"""
+    position = self._position(file_id)
+    data = os.pread(self._descriptor(), int(self.compressed_sizes[position]), int(self.offsets[position]))
+    method = int(self.methods[position])
+    if method == _deflated:
+      import zlib
+      return zlib.decompress(data, -zlib.MAX_WBITS)
+    if method != _stored:
+      raise ValueError("The image %d in the zip archive '%s' uses the unsupported compression method %d" % (file_id, self.filename, method))
+    return data
+
+
+# the archives opened in this process
+_archives = {}
+
+def open_archive(filename, index_file = None):
+  """Returns the :py:class:`ImageArchive` of the given zip archive, which is opened only once per process"""
+  key = (os.path.abspath(filename), index_file)
+  archive = _archives.get(key)
+  if archive is None:
+    archive = _archives.setdefault(key, ImageArchive(filename, index_file))
+  return archive
+
+
+def _pil_image():
+  """Returns the ``PIL.Image`` module of the optional Pillow package"""
+  try:
+    from PIL import Image
+  except ImportError:
+    raise ImportError("Decoding the images requires the 'Pillow' package; please install it, e.g., with the 'images' extra of bob.db.celeba, or pass a loader")
+  return Image
+
+
+def decode(f):
+  """Decodes the image in the given file object with PIL into a ``uint8`` array in the layout of :py:func:`bob.io.base.load`, i.e., (3, H, W) for color images"""
+  Image = _pil_image()
+  image = numpy.asarray(Image.open(f).convert('RGB'))
+  return image.transpose(2, 0, 1)
+
+
+def load_image(archive, file_id, loader = None):
+  """Reads the image with the given file id from the given archive, and decodes it with the given ``loader``, which receives a file object; by default, :py:func:`decode` is used"""
+  return (loader or decode)(io.BytesIO(archive.read(file_id)))
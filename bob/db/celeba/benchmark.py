@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Latency and memory benchmarks of the database API.
+
+Each benchmark is a function that receives the :py:class:`bob.db.celeba.Database` and a seeded :py:class:`random.Random` object, performs its setup, and returns the function that is timed.
+Cold start benchmarks are run in fresh interpreters, memory benchmarks report bytes instead of seconds.
+Results can be saved to and compared with a JSON file, so that performance regressions are detected before a release.
+
+Run the benchmarks with ``bob_dbmanage.py celeba benchmark``.
+"""
+
+import sys
+import json
+import time
+import random
+import timeit
+import subprocess
+
+# the registered benchmarks, in the order of registration
+benchmarks = []
+# the seed used for all random selections
+seed = 42
+
+def _benchmark(function):
+  benchmarks.append(function)
+  return function
+
+def _sample(random, population, size):
+  return random.sample(population, min(size, len(population)))
+
+def _cold(statement, repeat):
+  """Returns the minimum time that a fresh interpreter needs to run the given statement"""
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', statement])
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def cold_import(repeat):
+  """Time to start the interpreter and import the package"""
+  return _cold('import bob.db.celeba', repeat)
+
+def cold_load(repeat):
+  """Time to start the interpreter and load all protocol tables (from the binary cache, if enabled)"""
+  return _cold('import bob.db.celeba; bob.db.celeba.models.load_protocol()', repeat)
+
+def cold_objects(repeat):
+  """Time to start the interpreter and query all training files"""
+  return _cold('import bob.db.celeba; bob.db.celeba.Database().objects("training")', repeat)
+
+cold_benchmarks = (cold_import, cold_load, cold_objects)
+
+
+@_benchmark
+def get_files(db, random):
+  from .models import get_files
+  return get_files
+
+@_benchmark
+def get_attributes(db, random):
+  from .models import get_attributes
+  ids = _sample(random, db.object_ids().tolist(), 1000)
+  return lambda: [get_attributes()[i] for i in ids]
+
+@_benchmark
+def objects(db, random):
+  return lambda: db.objects()
+
+@_benchmark
+def training_set(db, random):
+  return db.training_set
+
+@_benchmark
+def objects_with_attributes(db, random):
+  return lambda: db.objects("training", with_attributes=["Sideburns", "Attractive"], without_attributes="Young")
+
+@_benchmark
+def query(db, random):
+  return lambda: db.query("Male & (Goatee | Mustache) & !Young", "training")
+
+@_benchmark
+def annotations(db, random):
+  files = _sample(random, db.objects(), 1000)
+  return lambda: [db.annotations(f) for f in files]
+
+@_benchmark
+def attributes(db, random):
+  files = _sample(random, db.objects(), 1000)
+  return lambda: [db.attributes(f) for f in files]
+
+@_benchmark
+def original_file_name(db, random):
+  files = _sample(random, db.objects(), 1000)
+  return lambda: [db.original_file_name(f) for f in files]
+
+@_benchmark
+def annotations_batch(db, random):
+  ids = _sample(random, db.object_ids().tolist(), 512)
+  return lambda: db.annotations_batch(ids)
+
+@_benchmark
+def attributes_batch(db, random):
+  ids = _sample(random, db.object_ids().tolist(), 512)
+  return lambda: db.attributes_batch(ids)
+
+@_benchmark
+def paths(db, random):
+  ids = db.object_ids()
+  return lambda: db.paths(ids, "/path/to/files", ".jpg")
+
+@_benchmark
+def attribute_statistics(db, random):
+  from .models import get_table
+  table = get_table()
+  def statistics():
+    table._statistics.clear()
+    return table.attribute_statistics((0,))
+  return statistics
+
+
+def memory(db):
+  """Returns the peak of the memory allocated by Python while querying and retrieving all files, and the maximum resident set size of the process"""
+  import tracemalloc
+  tracemalloc.start()
+  try:
+    files = db.objects()
+    db.annotations_batch(files)
+    db.attributes_batch(files)
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  results = {'memory_peak' : peak}
+  try:
+    import resource
+    # the maximum resident set size is given in kilobytes on Linux, but in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['memory_rss'] = rss if sys.platform == 'darwin' else rss * 1024
+  except ImportError:
+    pass
+  return results
+
+
+def run(names = None, repeat = 5, number = 1, cold = True, output = None):
+  """Runs the benchmarks with the given names (all, if ``None``) and returns a dictionary of results.
+
+  Time benchmarks report the minimum time in seconds of ``repeat`` runs of ``number`` calls, divided by ``number``.
+  Memory benchmarks report bytes.
+  If ``output`` is given, the results are written to this stream while they are measured.
+  """
+  from .query import Database
+  names = names or None
+  db = Database()
+  # load the tables, so that the warm benchmarks do not include the loading
+  db.objects()
+
+  results = {}
+  def _report(name, value):
+    results[name] = value
+    if output is not None:
+      output.write('%-28s %s\n' % (name, _format(name, value)))
+
+  if cold:
+    for function in cold_benchmarks:
+      if names is None or function.__name__ in names:
+        _report(function.__name__, function(repeat))
+
+  for function in benchmarks:
+    if names is None or function.__name__ in names:
+      statement = function(db, random.Random(seed))
+      # warm up
+      statement()
+      _report(function.__name__, min(timeit.repeat(statement, number=number, repeat=repeat)) / number)
+
+  if names is None or 'memory' in names:
+    for name, value in sorted(memory(db).items()):
+      _report(name, value)
+
+  return results
+
+
+def _format(name, value):
+  if name.startswith('memory'):
+    return '%10.1f MB' % (value / 1024. / 1024.)
+  return '%10.3f ms' % (value * 1000.)
+
+
+def save(results, filename):
+  """Saves the given benchmark results to the given JSON file"""
+  with open(filename, 'w') as f:
+    json.dump({'python' : sys.version.split()[0], 'results' : results}, f, indent=1, sort_keys=True)
+
+
+def compare(results, filename, tolerance = 0.2, output = None):
+  """Compares the given results with the baseline stored in the given JSON file.
+
+  A result is a regression, if it is more than ``tolerance`` (relative) larger than the baseline.
+  Returns the list of names of the regressed benchmarks.
+  """
+  with open(filename) as f:
+    baseline = json.load(f)['results']
+
+  regressions = []
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    ratio = results[name] / baseline[name] if baseline[name] else float('inf')
+    regressed = ratio > 1. + tolerance
+    if regressed:
+      regressions.append(name)
+    if output is not None:
+      output.write('%-28s %s -> %s (%5.2fx)%s\n' % (name, _format(name, baseline[name]), _format(name, results[name]), ratio, ' REGRESSION' if regressed else ''))
+  return regressions
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bitmap index of the CelebA attributes and a boolean query language that is evaluated on it.
+
+The query language knows the following constructs, listed from the highest to the lowest precedence:
+
+* an attribute name, e.g., ``Male``, which selects all images that have this attribute
+* ``( expression )``, to group expressions
+* ``atleast(k, expression, expression, ...)``, which selects images for which at least ``k`` of the given expressions hold
+* ``!expression`` or ``~expression``, the negation
+* ``expression & expression``, the conjunction
+* ``expression | expression``, the disjunction
+
+For example, ``Male & (Goatee | Mustache) & !Young`` selects all old men that have a goatee or a mustache.
+"""
+
+import re
+
+import numpy
+
+from .models import Attributes, purpose_names
+
+_token = re.compile(r"\s*(?:([A-Za-z0-9_]+)|(.))")
+
+
+def _pack(bits):
+  """Packs the given (M,N) boolean matrix into a (M,W) matrix of ``uint64`` words, where bit ``n % 64`` of word ``n // 64`` represents column ``n``"""
+  bits = numpy.asarray(bits, dtype=bool)
+  padded = numpy.zeros((bits.shape[0], (bits.shape[1] + 63) // 64 * 64), dtype=bool)
+  padded[:, :bits.shape[1]] = bits
+  return numpy.packbits(padded, axis=1, bitorder='little').view(numpy.uint64)
+
+
+class AttributeIndex:
+  """A bitmap index that stores one packed bit set per attribute and per purpose over all rows of a :py:class:`bob.db.celeba.models.CelebATable`.
+
+  Queries are evaluated with word-level bitwise operations on these bit sets.
+  """
+
+  def __init__(self, table):
+    self.size = len(table)
+    self.attributes = _pack(numpy.transpose(table.attributes == 1))
+    self.purposes = _pack(table.purpose[None, :] == numpy.arange(len(purpose_names), dtype=table.purpose.dtype)[:, None])
+    self.all = _pack(numpy.ones((1, self.size), dtype=bool))[0]
+
+  def attribute(self, name):
+    """Returns the bit set of the given attribute name"""
+    if name not in Attributes.attribute_indices:
+      raise ValueError("Invalid attribute '%s'. Valid values are %s" % (name, Attributes.attribute_names))
+    return self.attributes[Attributes.attribute_indices[name]]
+
+  def purpose(self, purposes):
+    """Returns the bit set of the union of the given purposes, which must be from :py:data:`bob.db.celeba.models.purpose_names`"""
+    return numpy.bitwise_or.reduce(self.purposes[[purpose_names.index(p) for p in purposes]], axis=0)
+
+  def evaluate(self, expression):
+    """Parses and evaluates the given query ``expression`` and returns the resulting bit set"""
+    return _Parser(self, expression).parse()
+
+  def rows(self, bits):
+    """Returns the (sorted) rows that are set in the given bit set"""
+    return numpy.flatnonzero(numpy.unpackbits(bits.view(numpy.uint8), bitorder='little')[:self.size])
+
+  def count(self, bits):
+    """Returns the number of rows that are set in the given bit set"""
+    return int(numpy.unpackbits(bits.view(numpy.uint8)).sum())
+
+
+class _Parser:
+  """Recursive descent parser that evaluates the query language on an :py:class:`AttributeIndex` while parsing"""
+
+  def __init__(self, index, expression):
+    self.index = index
+    self.expression = expression
+    self.tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+      match = _token.match(expression, position)
+      self.tokens.append(match.group(1) or match.group(2))
+      position = match.end()
+    self.position = 0
+
+  def _error(self, message):
+    return ValueError("Invalid attribute query '%s': %s" % (self.expression, message))
+
+  def _peek(self):
+    return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+  def _next(self):
+    token = self._peek()
+    if token is None:
+      raise self._error("unexpected end of expression")
+    self.position += 1
+    return token
+
+  def _expect(self, token):
+    found = self._next()
+    if found != token:
+      raise self._error("expected '%s', but found '%s'" % (token, found))
+
+  def parse(self):
+    result = self._or()
+    if self._peek() is not None:
+      raise self._error("unexpected '%s'" % self._peek())
+    return result
+
+  def _or(self):
+    result = self._and()
+    while self._peek() == '|':
+      self._next()
+      result = result | self._and()
+    return result
+
+  def _and(self):
+    result = self._not()
+    while self._peek() == '&':
+      self._next()
+      result = result & self._not()
+    return result
+
+  def _not(self):
+    if self._peek() in ('!', '~'):
+      self._next()
+      return ~self._not() & self.index.all
+    return self._atom()
+
+  def _atom(self):
+    token = self._next()
+    if token == '(':
+      result = self._or()
+      self._expect(')')
+      return result
+    if token == 'atleast' and self._peek() == '(':
+      return self._atleast()
+    if token in Attributes.attribute_indices:
+      return self.index.attribute(token)
+    raise self._error("unknown attribute '%s'" % token)
+
+  def _atleast(self):
+    self._expect('(')
+    k = self._next()
+    if not k.isdigit():
+      raise self._error("expected the number of required expressions in 'atleast', but found '%s'" % k)
+    k = int(k)
+    operands = []
+    while self._peek() == ',':
+      self._next()
+      operands.append(self._or())
+    self._expect(')')
+    if not operands:
+      raise self._error("'atleast' requires at least one expression")
+
+    # counters[j] holds the rows for which at least j+1 of the operands hold
+    counters = [numpy.zeros_like(self.index.all) for _ in range(k)]
+    for operand in operands:
+      for j in range(k - 1, 0, -1):
+        counters[j] |= counters[j - 1] & operand
+      if k:
+        counters[0] |= operand
+    return counters[-1] if k else self.index.all.copy()
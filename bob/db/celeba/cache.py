@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Binary cache of the CelebA protocol, stored as memory-mapped NumPy arrays.
+
+The cache consists of one ``.npy`` file per array and a ``protocol.json`` file that records the protocol file, from which the arrays were built:
+
+* ``ids.npy``: the (N,) ``int32`` file ids
+* ``purpose.npy``: the (N,) ``int8`` purpose codes, which index :py:data:`bob.db.celeba.models.purpose_names`
+* ``attributes.npy``: the (N,40) ``int8`` attribute matrix with values ``+1`` and ``-1``
+* ``landmarks.npy``: the (N,10) ``int16`` landmark matrix, in the order of the list file
+* ``bboxes.npy``: the (N,4) ``int16`` bounding boxes of the in-the-wild images
+
+Only the ``ids`` are required; the other arrays are stored if the protocol source contains them, e.g., the sources of the in-the-wild images contain the landmarks and bounding boxes only.
+
+Arrays are opened with ``numpy.load(mmap_mode='r')``, so that all processes share the same pages.
+Additionally, the attribute statistics of each combination of purposes are cached in ``statistics-<purposes>.npz`` files.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+import numpy
+
+logger = logging.getLogger("bob.db.celeba")
+
+# increase this number whenever the layout of the cache changes
+cache_version = 2
+
+# the arrays stored in the cache and their data types
+array_types = (
+  ('ids', numpy.int32),
+  ('purpose', numpy.int8),
+  ('attributes', numpy.int8),
+  ('landmarks', numpy.int16),
+  ('bboxes', numpy.int16),
+)
+# the arrays that are optional, i.e., which are only stored when they are given
+optional_arrays = ('purpose', 'attributes', 'landmarks', 'bboxes')
+
+def _metadata_file(directory):
+  return os.path.join(directory, 'protocol.json')
+
+def _array_file(directory, name):
+  return os.path.join(directory, name + '.npy')
+
+def _files(source):
+  """Returns the files of the given protocol source, which is either a file or a directory"""
+  if os.path.isdir(source):
+    return [os.path.join(source, name) for name in sorted(os.listdir(source)) if os.path.isfile(os.path.join(source, name))]
+  return [source]
+
+def _stat(source):
+  """Returns the total size and the latest modification time of the files of the given protocol source"""
+  stats = [os.stat(f) for f in _files(source)]
+  return sum(s.st_size for s in stats), max([s.st_mtime for s in stats] or [0.])
+
+def _hash(source):
+  """Computes the SHA-1 hash of the given protocol source; for directories, the names and contents of all files are hashed"""
+  sha1 = hashlib.sha1()
+  for filename in _files(source):
+    if filename != source:
+      sha1.update(os.path.basename(filename).encode('utf-8'))
+    with open(filename, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        sha1.update(chunk)
+  return sha1.hexdigest()
+
+def _replace(filename, write):
+  """Writes a file through the given ``write`` function into a temporary file, and moves it to the given ``filename`` afterwards.
+  This assures that concurrent processes never see a partially written file."""
+  temp = "%s.%d.tmp" % (filename, os.getpid())
+  try:
+    with open(temp, 'wb') as f:
+      write(f)
+    os.replace(temp, filename)
+  finally:
+    if os.path.exists(temp):
+      os.remove(temp)
+
+
+def is_valid(directory, protocol_file):
+  """Checks if the cache in the given ``directory`` is up-to-date with the given ``protocol_file``, which might also be a directory, see :py:mod:`bob.db.celeba.sources`.
+
+  The modification time and size of the protocol file are compared first.
+  Only if these differ, the (more expensive) hash of the protocol file is compared, and the stored modification time is updated when the hash is identical.
+  """
+  try:
+    with open(_metadata_file(directory)) as f:
+      metadata = json.load(f)
+  except (IOError, OSError, ValueError):
+    return False
+
+  if metadata.get('version') != cache_version:
+    return False
+  if not all(os.path.exists(_array_file(directory, name)) for name in metadata.get('arrays', ())):
+    return False
+
+  size, mtime = _stat(protocol_file)
+  if metadata.get('size') == size and metadata.get('mtime') == mtime:
+    return True
+
+  if metadata.get('size') != size or metadata.get('sha1') != _hash(protocol_file):
+    return False
+
+  # the protocol file has been touched, but not modified
+  metadata['mtime'] = mtime
+  try:
+    _replace(_metadata_file(directory), lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+  except (IOError, OSError):
+    pass
+  return True
+
+
+def read(directory):
+  """Opens the arrays stored in the cache in the given ``directory`` as read-only memory maps.
+  Returns a dictionary with the array names as keys, which does not contain optional arrays that were not stored."""
+  with open(_metadata_file(directory)) as f:
+    names = json.load(f)['arrays']
+  return {name : numpy.load(_array_file(directory, name), mmap_mode='r') for name in names}
+
+
+def _statistics_file(directory, key):
+  return os.path.join(directory, 'statistics-%s.npz' % key)
+
+def read_statistics(directory, key):
+  """Reads the attribute statistics with the given ``key`` from the cache in the given ``directory``.
+  Returns ``None`` if the statistics are not cached, or if they were computed from a different protocol file."""
+  try:
+    with open(_metadata_file(directory)) as f:
+      sha1 = json.load(f).get('sha1')
+    with numpy.load(_statistics_file(directory, key)) as data:
+      if str(data['sha1']) != sha1:
+        return None
+      return {name : data[name] for name in data.files if name != 'sha1'}
+  except (IOError, OSError, ValueError, KeyError):
+    return None
+
+def write_statistics(directory, key, statistics):
+  """Writes the given dictionary of attribute ``statistics`` with the given ``key`` into the cache in the given ``directory``, next to the protocol arrays"""
+  with open(_metadata_file(directory)) as f:
+    sha1 = json.load(f)['sha1']
+  _replace(_statistics_file(directory, key), lambda f: numpy.savez(f, sha1=sha1, **statistics))
+
+
+def write(directory, protocol_file, arrays):
+  """Writes the given dictionary of ``arrays``, which was built from the given ``protocol_file``, into the cache in the given ``directory``.
+  Optional arrays (see :py:data:`optional_arrays`) are skipped, when they are missing or ``None``.
+  The metadata file is written last, so that an interrupted write leaves an invalid cache behind."""
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  names = []
+  for name, dtype in array_types:
+    if name in optional_arrays and arrays.get(name) is None:
+      continue
+    array = numpy.ascontiguousarray(arrays[name], dtype=dtype)
+    _replace(_array_file(directory, name), lambda f: numpy.save(f, array))
+    names.append(name)
+
+  size, mtime = _stat(protocol_file)
+  metadata = {
+    'version' : cache_version,
+    'protocol_file' : os.path.abspath(protocol_file),
+    'size' : size,
+    'mtime' : mtime,
+    'sha1' : _hash(protocol_file),
+    'arrays' : names,
+  }
+  _replace(_metadata_file(directory), lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+  logger.info("Wrote the binary cache of '%s' to '%s'", protocol_file, directory)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Creates the indexed SQLite database of the CelebA protocol, see :py:data:`bob.db.celeba.models.sql_tables` for its layout.
+"""
+
+import os
+import sys
+
+
+def create_sqlite(filename):
+  """Writes all protocol information into a new SQLite database with the given ``filename``.
+  The database is written to a temporary file first, so that an existing database is replaced atomically.
+  Returns the number of files written."""
+  import sqlite3
+  from .models import get_table, purpose_names, sql_tables, sql_indexes, protocol_members
+
+  table = get_table(protocol_members)
+  temp = "%s.%d.tmp" % (filename, os.getpid())
+  if os.path.exists(temp):
+    os.remove(temp)
+
+  try:
+    connection = sqlite3.connect(temp)
+    try:
+      with connection:
+        for statement in sql_tables:
+          connection.execute(statement)
+        connection.executemany('INSERT INTO purposes VALUES (?, ?)', enumerate(purpose_names))
+        ids = table.ids.tolist()
+        connection.executemany('INSERT INTO files VALUES (?, ?)', zip(ids, table.purpose.tolist()))
+        connection.executemany('INSERT INTO attributes VALUES (?%s)' % (', ?' * 40), ([i] + a for i, a in zip(ids, table.attributes.tolist())))
+        connection.executemany('INSERT INTO landmarks VALUES (?%s)' % (', ?' * 10), ([i] + l for i, l in zip(ids, table.landmarks.tolist())))
+        # indexes are faster to create after the data is inserted
+        for statement in sql_indexes:
+          connection.execute(statement)
+      connection.execute('ANALYZE')
+    finally:
+      connection.close()
+    os.replace(temp, filename)
+  finally:
+    if os.path.exists(temp):
+      os.remove(temp)
+
+  return len(ids)
+
+
+def create(args):
+  """Creates or re-creates the indexed SQLite database of the protocol"""
+
+  from .models import sqlite_file
+  filename = args.sqlite_file or sqlite_file
+
+  if os.path.exists(filename) and not args.recreate:
+    sys.stderr.write('The database "%s" already exists; use --recreate to overwrite it\n' % filename)
+    return 1
+
+  count = create_sqlite(filename)
+  if args.verbose:
+    sys.stdout.write('Wrote %d files to "%s"\n' % (count, filename))
+
+  return 0
+
+
+def add_command(subparsers):
+  """Add specific subcommands that the action "create" can use"""
+
+  parser = subparsers.add_parser('create', help=create.__doc__)
+  parser.add_argument('-R', '--recreate', action='store_true', help="if set, an existing database is overwritten.")
+  parser.add_argument('-f', '--sqlite-file', help="the SQLite database to write; by default, the 'db.sql3' file of this package.")
+  parser.add_argument('-v', '--verbose', action='count', default=0, help="report the number of written files.")
+  parser.set_defaults(func=create) #action
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Crop-on-read of the faces in the in-the-wild images, based on their bounding boxes.
+
+The in-the-wild images are large, while the faces usually cover only a small part of them.
+When the crop is resized to a smaller ``size``, JPEG images are decoded in draft mode, i.e., the decoder scales the image down by a factor of 2, 4 or 8 in the DCT domain, so that most of the inverse DCT and color conversion work is skipped.
+The largest factor is chosen that still keeps at least the requested resolution inside the crop.
+Decoding requires the optional Pillow package.
+"""
+
+import math
+
+import numpy
+
+
+def crop_boxes(bounding_boxes, margin = 0.):
+  """Returns the regions to crop for the given bounding boxes.
+
+  Keyword parameters:
+
+  ``bounding_boxes`` : (B, 2, 2) array_like
+    The ``(y,x)`` coordinates of the top left and the bottom right corners of the bounding boxes, see :py:meth:`bob.db.celeba.Database.bounding_boxes_batch`.
+
+  ``margin`` : float
+    The margin that is added on each side of the bounding boxes, relative to their height and width.
+
+  Returns the (B, 4) ``float64`` array of ``(top, left, bottom, right)`` coordinates of the regions.
+  """
+  bounding_boxes = numpy.asarray(bounding_boxes, dtype=numpy.float64)
+  topleft, bottomright = bounding_boxes[:, 0], bounding_boxes[:, 1]
+  border = (bottomright - topleft) * margin
+  return numpy.concatenate((topleft - border, bottomright + border), axis=1)
+
+
+def crop_annotations(annotations, boxes, size = None):
+  """Transforms the given (B, K, 2) ``(y,x)`` annotations of the full images into the coordinates of the crops of the given (B, 4) ``boxes``, which are optionally resized to the given ``(height, width)``"""
+  annotations = numpy.asarray(annotations, dtype=numpy.float64)
+  boxes = numpy.asarray(boxes, dtype=numpy.float64)
+  cropped = annotations - boxes[:, None, :2]
+  if size is not None:
+    cropped *= numpy.asarray(size, dtype=numpy.float64) / (boxes[:, 2:] - boxes[:, :2])[:, None, :]
+  return cropped
+
+
+def decode_crop(f, box, size = None):
+  """Decodes the given region of an image.
+
+  Keyword parameters:
+
+  ``f`` : str or file object
+    The image file to decode.
+
+  ``box`` : (top, left, bottom, right)
+    The region to crop, see :py:func:`crop_boxes`; parts of the region outside of the image are filled with zeros.
+
+  ``size`` : (height, width) or ``None``
+    If given, the crop is resized to this size, and JPEG images are decoded at the lowest scale that keeps this resolution.
+
+  Returns the ``uint8`` crop in the layout of :py:func:`bob.io.base.load`, i.e., (3, height, width).
+  """
+  from .archive import _pil_image
+  Image = _pil_image()
+  top, left, bottom, right = (float(b) for b in box)
+  if size is None:
+    size = (int(round(bottom - top)), int(round(right - left)))
+  height, width = size
+
+  image = Image.open(f)
+  full_width, full_height = image.size
+  scale = max(width / (right - left), height / (bottom - top))
+  if scale < 1.:
+    # for JPEG images, this selects the decoder scale; other images are not affected
+    image.draft('RGB', (int(math.ceil(full_width * scale)), int(math.ceil(full_height * scale))))
+  scale_x, scale_y = image.size[0] / float(full_width), image.size[1] / float(full_height)
+
+  extent = getattr(Image, 'Transform', Image).EXTENT
+  resample = getattr(Image, 'Resampling', Image).BILINEAR
+  image = image.convert('RGB').transform((width, height), extent, (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y), resample)
+  return numpy.asarray(image).transpose(2, 0, 1)
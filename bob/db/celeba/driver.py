@@ -23,56 +23,176 @@ import sys
 from bob.db.base.driver import Interface as BaseInterface
 
 
+def _listing(table, rows, directory, extension, format, chunk_size = 4096):
+  """Generates the text of the file listing of the given rows in chunks of ``chunk_size`` files"""
+  from .models import Attributes, purpose_names
+  from .query import path_template
+  template = path_template(directory, extension)
+
+  if format == 'csv':
+    yield ','.join(('id', 'path', 'purpose') + Attributes.attribute_names) + '\n'
+
+  for start in range(0, len(rows), chunk_size):
+    chunk = rows[start:start+chunk_size]
+    ids = table.ids[chunk].tolist()
+    if format == 'csv':
+      purposes = table.purpose[chunk].tolist()
+      attributes = table.attributes[chunk].tolist()
+      yield ''.join('%d,%s,%s,%s\n' % (i, template % i, purpose_names[p], ','.join(map(str, a))) for i, p, a in zip(ids, purposes, attributes))
+    else:
+      end = '\0' if format == 'null' else '\n'
+      yield ''.join(template % i + end for i in ids)
+
+
 def dumplist(args):
   """Dumps lists of files based on your criteria"""
 
   from .query import Database
+  from .models import get_table
   db = Database()
 
-  r = db.objects(
-      groups=args.group,
-      protocol=args.protocol,
-      purposes=args.purpose,
-      model_ids=args.template_id
-  )
+  table, rows = db._object_rows(*db._check_object_parameters(args.purpose, args.with_attributes, args.without_attributes))
+  if args.format == 'csv':
+    # the attributes are written as well
+    table = get_table(('list_eval_partition.txt', 'list_attr_celeba.txt'))
 
   output = sys.stdout
   if args.selftest:
     from bob.db.base.utils import null
     output = null()
 
-  for f in r:
-    output.write('%s\n' % (f.make_path(args.directory, args.extension, args.add_sighting_id),))
+  try:
+    for chunk in _listing(table, rows, args.directory, args.extension, args.format):
+      output.write(chunk)
+    output.flush()
+  except BrokenPipeError:
+    # the reader has exited, e.g., 'dumplist | head'; redirect the remaining output, so that flushing stdout at exit does not fail again
+    os.dup2(os.open(os.devnull, os.O_WRONLY), output.fileno())
 
   return 0
 
 
+# the first bytes of every JPEG file
+_jpeg_magic = b'\xff\xd8\xff'
+
+def _check_batch(names, directory, verify, listing):
+  """Checks the given batch of file names; returns the lists of indexes of missing and corrupt files"""
+  missing, corrupt = [], []
+  for i, name in enumerate(names):
+    if listing is not None and name not in listing:
+      missing.append(i)
+      continue
+    path = os.path.join(directory, name)
+    try:
+      if verify == 'exists':
+        if listing is None and not os.path.isfile(path):
+          missing.append(i)
+      elif verify == 'size':
+        if os.stat(path).st_size == 0:
+          corrupt.append(i)
+      else:
+        with open(path, 'rb') as f:
+          if f.read(len(_jpeg_magic)) != _jpeg_magic:
+            corrupt.append(i)
+    except (IOError, OSError):
+      # files that exist, but cannot be read, are corrupt
+      (corrupt if os.path.exists(path) else missing).append(i)
+  return missing, corrupt
+
+
+def _check_archive_batch(ids, archive, verify):
+  """Checks the images with the given ids in the given :py:class:`bob.db.celeba.archive.ImageArchive`; returns the lists of indexes of missing and corrupt images"""
+  import zlib
+  missing, corrupt = [], []
+  for i, file_id in enumerate(ids):
+    if file_id not in archive:
+      missing.append(i)
+    elif verify == 'size' and archive.size(file_id) == 0:
+      corrupt.append(i)
+    elif verify == 'jpeg':
+      try:
+        if archive.read(file_id)[:len(_jpeg_magic)] != _jpeg_magic:
+          corrupt.append(i)
+      except (IOError, OSError, ValueError, zlib.error):
+        corrupt.append(i)
+  return missing, corrupt
+
+
 def checkfiles(args):
   """Checks existence of files based on your criteria"""
 
-  from .query import Database
-  db = Database()
-
-  r = db.objects()
+  import time
+  import json
+  from concurrent.futures import ThreadPoolExecutor
+  from .models import get_table
 
-  # go through all files, check if they are available on the filesystem
-  good = {}
-  bad = {}
-  for f in r:
-    if os.path.exists(f.make_path(args.directory,args.extension,args.add_sighting_id)): good[f.id] = f
-    else: bad[f.id] = f
+  ids = get_table('list_eval_partition.txt').ids
+  directory = args.directory or os.curdir
+  extension = args.extension or ''
 
-  # report
   output = sys.stdout
   if args.selftest:
     from bob.db.base.utils import null
     output = null()
 
-  if bad:
-    for id, f in bad.items():
-      output.write('Cannot find file "%s"\n' % f.make_path(args.directory,args.extension,args.add_sighting_id))
-    output.write('%d files (out of %d) were not found at "%s"\n' % \
-        (len(bad), len(r), args.directory))
+  start = time.time()
+  # list the directory once, unless each file has to be checked individually
+  listing = None
+  if args.archive:
+    from .archive import open_archive
+    archive = open_archive(args.archive)
+    directory = args.archive
+  elif not args.stat:
+    try:
+      listing = set(entry.name for entry in os.scandir(directory))
+    except (IOError, OSError) as e:
+      output.write('Cannot list directory "%s" (%s); checking each file\n' % (directory, e))
+
+  names = ["%06d%s" % (i, extension) for i in ids.tolist()]
+  batches = [names[i:i+args.batch_size] for i in range(0, len(names), args.batch_size)]
+
+  # check the files in parallel, if required
+  missing, corrupt = [], []
+  if args.archive:
+    id_batches = [ids[i:i+args.batch_size].tolist() for i in range(0, len(ids), args.batch_size)]
+    check, work = (lambda batch: _check_archive_batch(batch, archive, args.verify)), id_batches
+  else:
+    check, work = (lambda batch: _check_batch(batch, directory, args.verify, listing)), batches
+  with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    # the listed files are checked in this thread, as this does not touch the file system
+    results = map(check, work) if listing is not None and args.verify == 'exists' else executor.map(check, work)
+    # the results are consumed while the executor is running, so that the progress is reported during the check
+    checked = 0
+    for b, (batch_missing, batch_corrupt) in enumerate(results):
+      missing.extend(b * args.batch_size + i for i in batch_missing)
+      corrupt.extend(b * args.batch_size + i for i in batch_corrupt)
+      checked += len(batches[b])
+      if args.progress and (b + 1) % args.progress == 0:
+        sys.stderr.write('Checked %d of %d files (%.0f files/s)\n' % (checked, len(names), checked / max(time.time() - start, 1e-9)))
+  seconds = time.time() - start
+
+  # report
+  for i in missing:
+    output.write('Cannot find file "%s"\n' % os.path.join(directory, names[i]))
+  for i in corrupt:
+    output.write('Corrupt file "%s"\n' % os.path.join(directory, names[i]))
+  if missing:
+    output.write('%d files (out of %d) were not found at "%s"\n' % (len(missing), len(names), directory))
+  if corrupt:
+    output.write('%d files (out of %d) are corrupt at "%s"\n' % (len(corrupt), len(names), directory))
+  output.write('Checked %d files in %.2f seconds (%.0f files/s)\n' % (len(names), seconds, len(names) / max(seconds, 1e-9)))
+
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump({
+        'directory' : directory,
+        'extension' : extension,
+        'verify' : args.verify,
+        'checked' : len(names),
+        'seconds' : seconds,
+        'missing' : [int(ids[i]) for i in missing],
+        'corrupt' : [int(ids[i]) for i in corrupt],
+      }, f, indent=1)
 
   return 0
 
@@ -115,6 +235,83 @@ def path(args):
   return 0
 
 
+def pack(args):
+  """Packs the (aligned) images into a single memory-mapped file"""
+
+  from .query import Database
+  from .packed import pack as pack_images
+  from .alignment import FaceAlignment
+  db = Database(args.directory, args.extension, original_archive=args.archive)
+
+  alignment = None
+  if args.align:
+    alignment = FaceAlignment(crop_size=args.crop_size, right_eye=args.right_eye, left_eye=args.left_eye)
+
+  files = db.objects(args.purpose)
+  packed = pack_images(db, files, args.output, alignment=alignment, size=args.size, batch_size=args.batch_size, num_workers=args.jobs)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+  output.write('Packed %d images of shape %s into "%s"\n' % (len(packed), packed.images.shape[1:], args.output))
+
+  return 0
+
+
+def _positive_int(value):
+  """Converts the given command line argument into a positive integer"""
+  import argparse
+  number = int(value)
+  if number < 1:
+    raise argparse.ArgumentTypeError("%s is not a positive number" % value)
+  return number
+
+
+def export(args):
+  """Exports the images into size-balanced shards for distributed training"""
+
+  from .query import Database
+  from .shards import export as export_shards
+  db = Database(args.directory, args.extension, original_archive=args.archive)
+
+  manifest = export_shards(db, db.objects(args.purpose), args.output, args.shards)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+  for shard in manifest['shards']:
+    output.write('%s: %d images, %d bytes\n' % (shard['name'], shard['count'], shard['bytes']))
+
+  return 0
+
+
+def benchmark(args):
+  """Measures the latency and memory footprint of the database API"""
+
+  from . import benchmark as benchmarks
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  results = benchmarks.run(args.benchmarks, repeat=args.repeat, cold=not args.warm, output=output)
+
+  if args.save:
+    benchmarks.save(results, args.save)
+
+  if args.compare:
+    output.write('\nComparison with "%s":\n' % args.compare)
+    regressions = benchmarks.compare(results, args.compare, args.tolerance, output)
+    if regressions:
+      output.write('%d benchmarks regressed by more than %d%%: %s\n' % (len(regressions), args.tolerance * 100, ', '.join(regressions)))
+      return 1
+
+  return 0
+
+
 class Interface(BaseInterface):
 
   def name(self):
@@ -138,7 +335,7 @@ class Interface(BaseInterface):
     subparsers = self.setup_parser(parser, "CelebA database", docs)
 
 
-    # example: get the "create" action from a submodule
+    # the "create" action
     from .create import add_command as create_command
     create_command(subparsers)
 
@@ -151,6 +348,10 @@ class Interface(BaseInterface):
     parser = subparsers.add_parser('dumplist', help=dumplist.__doc__)
     parser.add_argument('-d', '--directory', help="if given, this path will be prepended to every entry returned.")
     parser.add_argument('-e', '--extension', help="if given, this extension will be appended to every entry returned.")
+    parser.add_argument('-p', '--purpose', nargs='+', choices=('training', 'world', 'validation', 'dev', 'test', 'eval'), help="if given, this value will limit the output files to those designed for the given purposes.")
+    parser.add_argument('-w', '--with-attributes', nargs='+', choices=db.attribute_names(), metavar='ATTRIBUTE', help="if given, limit the output files to those that have all the given attributes.")
+    parser.add_argument('-W', '--without-attributes', nargs='+', choices=db.attribute_names(), metavar='ATTRIBUTE', help="if given, limit the output files to those that have none of the given attributes.")
+    parser.add_argument('-f', '--format', choices=('path', 'csv', 'null'), default='path', help="write one path per line, CSV lines with the id, path, purpose and attributes of each file, or NUL-separated paths (e.g., for 'xargs -0').")
 
     parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
     parser.set_defaults(func=dumplist) #action
@@ -158,10 +359,58 @@ class Interface(BaseInterface):
     # the "checkfiles" action
     parser = subparsers.add_parser('checkfiles', help=checkfiles.__doc__)
     parser.add_argument('-d', '--directory', help="if given, this path will be prepended to every entry returned.")
-    parser.add_argument('-e', '--extension', help="if given, this extension will be appended to every entry returned.")
+    parser.add_argument('-e', '--extension', default='.jpg', help="the extension of the image files.")
+    parser.add_argument('-V', '--verify', choices=('exists', 'size', 'jpeg'), default='exists', help="check that the files exist, that they are not empty, or that they start with a JPEG header.")
+    parser.add_argument('-j', '--jobs', type=int, default=16, help="the number of threads used to check the files individually.")
+    parser.add_argument('-b', '--batch-size', type=int, default=1024, help="the number of files checked by a thread at a time.")
+    parser.add_argument('-s', '--stat', action='store_true', help="check each file individually instead of listing the directory once.")
+    parser.add_argument('-p', '--progress', type=int, default=0, help="if given, report the progress after the given number of batches.")
+    parser.add_argument('-r', '--report', help="if given, write the ids of the missing and corrupt files to this JSON file.")
+    parser.add_argument('-A', '--archive', help="if given, check the images inside this zip archive (e.g., img_align_celeba.zip) instead of the directory.")
     parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
     parser.set_defaults(func=checkfiles) #action
 
+    # the "pack" action
+    parser = subparsers.add_parser('pack', help=pack.__doc__)
+    parser.add_argument('output', help="the name of the packed dataset to write.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-d', '--directory', help="the directory containing the original images.")
+    group.add_argument('-A', '--archive', help="the zip archive containing the original images, e.g., img_align_celeba.zip.")
+    parser.add_argument('-e', '--extension', default='.jpg', help="the extension of the original images.")
+    parser.add_argument('-p', '--purpose', nargs='+', choices=('training', 'world', 'validation', 'dev', 'test', 'eval'), help="if given, only pack the images of the given purposes.")
+    parser.add_argument('-a', '--align', action='store_true', help="align the images based on their eye annotations.")
+    parser.add_argument('-c', '--crop-size', type=int, nargs=2, default=(80, 64), metavar=('HEIGHT', 'WIDTH'), help="the size of the aligned images.")
+    parser.add_argument('-r', '--right-eye', type=float, nargs=2, default=(16, 15), metavar=('Y', 'X'), help="the position of the right eye in the aligned images.")
+    parser.add_argument('-l', '--left-eye', type=float, nargs=2, default=(16, 48), metavar=('Y', 'X'), help="the position of the left eye in the aligned images.")
+    parser.add_argument('-s', '--size', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'), help="if given, the (aligned) images are resized to the given size.")
+    parser.add_argument('-j', '--jobs', type=int, help="the number of threads used to decode images; by default, the number of CPUs.")
+    parser.add_argument('-b', '--batch-size', type=int, default=256, help="the number of images that are aligned and written at a time.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=pack) #action
+
+    # the "export" action
+    parser = subparsers.add_parser('export', help=export.__doc__)
+    parser.add_argument('output', help="the directory to write the shards and the manifest into.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-d', '--directory', help="the directory containing the original images.")
+    group.add_argument('-A', '--archive', help="the zip archive containing the original images, e.g., img_align_celeba.zip.")
+    parser.add_argument('-e', '--extension', default='.jpg', help="the extension of the original images.")
+    parser.add_argument('-p', '--purpose', nargs='+', choices=('training', 'world', 'validation', 'dev', 'test', 'eval'), help="if given, only export the images of the given purposes.")
+    parser.add_argument('-n', '--shards', type=_positive_int, default=64, help="the number of shards per purpose.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=export) #action
+
+    # the "benchmark" action
+    parser = subparsers.add_parser('benchmark', help=benchmark.__doc__)
+    parser.add_argument('benchmarks', nargs='*', help="if given, only run the benchmarks with the given names; 'memory' selects the memory benchmarks.")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="the number of repetitions of each benchmark, of which the fastest is reported.")
+    parser.add_argument('-w', '--warm', action='store_true', help="skip the cold start benchmarks, which run in fresh interpreters.")
+    parser.add_argument('-s', '--save', help="if given, write the results to this JSON file.")
+    parser.add_argument('-c', '--compare', help="if given, compare the results with the baseline in this JSON file, and fail on regressions.")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2, help="the relative slowdown (or memory increase) that counts as a regression.")
+    parser.add_argument('--self-test', dest="selftest", action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(func=benchmark) #action
+
     # adds the "reverse" command
     parser = subparsers.add_parser('reverse', help=reverse.__doc__)
     parser.add_argument('path', nargs='+', help="one or more path stems to look up. If you provide more than one, files which cannot be reversed will be omitted from the output.")
@@ -18,9 +18,14 @@
 """Table models and functionality for the CelebA database.
 """
 import os
+import threading
+from collections.abc import Mapping
 
-import pkg_resources
-import tarfile
+# NumPy is imported by the functions that use it, so that 'import bob.db.celeba' does not load it
+
+def _label(index):
+  """Returns a read-only property to the given index of the landmarks of an :py:class:`Annotation`"""
+  return property(lambda self: int(self._labels[index]))
 
 class Annotation:
   """Annotations of the CelebA database consists of the locations of the two eyes, the nose tip and the mouth corners.
@@ -30,32 +35,55 @@ class Annotation:
      The eye and mouth locations given in the original annotation file are in observer perspective (i.e., the right eye is to the right of the left eye).
      To be consistent with other databases of Bob, here we change them to be in subject perspective (i.e., the right eye is to the left of the left eye).
      Also, as usual for Bob, coordinates are specified in ``(y,x)`` order, opposite to how they are written in the list file.
+
+  For the in-the-wild images, the annotations additionally contain the bounding box of the face, see :py:attr:`bbox_names`.
   """
-  def __init__(self, file_id, labels):
+  # the names of the labels, in the order of the list file
+  label_names = ('re_x', 're_y', 'le_x', 'le_y', 'n_x', 'n_y', 'rm_x', 'rm_y', 'lm_x', 'lm_y')
+  # the names of the annotations, and the indexes of their (y,x) coordinates in the list of labels
+  annotation_names = ('reye', 'leye', 'nose', 'rmouth', 'lmouth')
+  annotation_columns = (1, 0, 3, 2, 5, 4, 7, 6, 9, 8)
+  # the names of the values of the bounding boxes, in the order of the 'list_bbox_celeba.txt' file
+  bbox_names = ('x_1', 'y_1', 'width', 'height')
+
+  __slots__ = ('file_id', '_labels', '_bbox')
+
+  def __init__(self, file_id, labels, bbox = None):
     self.file_id = file_id
 
     assert len(labels) == 10
-    self.re_x = labels[0] # left eye in the list file
-    self.re_y = labels[1]
-    self.le_x = labels[2] # right eye in the list file
-    self.le_y = labels[3]
-    self.n_x = labels[4]
-    self.n_y = labels[5]
-    self.rm_x = labels[6] # left mouth in the list file
-    self.rm_y = labels[7]
-    self.lm_x = labels[8] # right mouth in the list file
-    self.lm_y = labels[9]
+    assert bbox is None or len(bbox) == 4
+    # the labels and the bounding box might be rows of the landmark and bounding box matrices of the :py:class:`CelebATable`
+    self._labels = labels
+    self._bbox = bbox
+
+  re_x = _label(0) # left eye in the list file
+  re_y = _label(1)
+  le_x = _label(2) # right eye in the list file
+  le_y = _label(3)
+  n_x = _label(4)
+  n_y = _label(5)
+  rm_x = _label(6) # left mouth in the list file
+  rm_y = _label(7)
+  lm_x = _label(8) # right mouth in the list file
+  lm_y = _label(9)
 
   def __call__(self):
     """Returns these annotations in a dictionary, which are: ``{'reye' : (re_y, re_x), 'leye' : (le_y, le_x), 'nose' : (n_y, n_x), 'rmouht' : (rm_y, rm_x), 'lmouth' : (lm_y, lm_x)}``.
+    If the annotations contain a bounding box, its corners are added as ``'topleft' : (y_1, x_1)`` and ``'bottomright' : (y_1 + height, x_1 + width)``.
     """
-    return {
+    annotations = {
       'reye' : (self.re_y, self.re_x),
       'leye' : (self.le_y, self.le_x),
       'nose' : (self.n_y, self.n_x),
       'rmouth' : (self.rm_y, self.rm_x),
       'lmouth' : (self.lm_y, self.lm_x),
     }
+    if self._bbox is not None:
+      x, y, width, height = (int(v) for v in self._bbox)
+      annotations['topleft'] = (y, x)
+      annotations['bottomright'] = (y + height, x + width)
+    return annotations
 
   def __repr__(self):
     return "<Annotation('%d')>" % self.file_id
@@ -112,18 +140,26 @@ class Attributes:
 
   attribute_indices = {a:i for i,a in enumerate(attribute_names)}
 
+  __slots__ = ('file_id', '_attributes')
+
   def __init__(self, file_id, attributes):
     self.file_id = file_id
 
     assert len(attributes) == 40
-    self.attributes = attributes
+    # the attributes might be a row of the attribute matrix of the :py:class:`CelebATable`
+    self._attributes = attributes
+
+  @property
+  def attributes(self):
+    """The list of all 40 attributes, in the order of :py:attr:`attribute_names`"""
+    return [int(a) for a in self._attributes]
 
   def __call__(self, attribute_names = None):
     """Returns these attributes in a dictionary, with the attribute name as key and the binary value ``+1`` or ``-1`` for the presence or absence of the attribute.
     """
     if attribute_names is None:
       return self.attributes
-    return [self.attributes[self.attribute_indices[a]] for a in attribute_names]
+    return [int(self._attributes[self.attribute_indices[a]]) for a in attribute_names]
 
   def __repr__(self):
     return "<Attributes('%d')>" % self.file_id
@@ -141,6 +177,8 @@ class File:
   * ``purpose``: the :py:class:`Purpose`, for which this file is used
 
   """
+  __slots__ = ('id', 'purpose_name')
+
   def __init__(self, file_id, purpose):
     self.id = file_id
     self.purpose_name = purpose
@@ -168,63 +206,627 @@ class File:
     return str(os.path.join(directory, "%06d%s" % (self.id, extension)))
 
 
-# dictionary storing the loaded protocol information
-protocol_file = pkg_resources.resource_filename("bob.db.celeba", "data/protocol.tar.bz2")
-files_list = []
-annotations_dict = {}
-attributes_dict = {}
-purpose_names = ("training", "validation", "test")
+class CelebATable:
+  """Columnar storage of the CelebA protocol, with one row per image.
+
+  The table consists of the following arrays, which all share the same row order:
 
-def _file_id(name):
-  return int(os.path.splitext(name)[0])
+  * ``ids``: the (N,) file ids
+  * ``purpose``: the (N,) purpose codes, which are indices into :py:data:`purpose_names`
+  * ``attributes``: the (N,40) attribute matrix with values ``+1`` and ``-1``, in the order of :py:attr:`Attributes.attribute_names`
+  * ``landmarks``: the (N,10) landmark matrix, in the order of :py:attr:`Annotation.label_names`
+  * ``bboxes``: the (N,4) bounding boxes of the faces in the in-the-wild images, in the order of :py:attr:`Annotation.bbox_names`
+
+  Columns that have not been loaded yet are ``None``.
+  :py:class:`File`, :py:class:`Attributes` and :py:class:`Annotation` objects are only created when a row is requested, and they are views into the rows of this table.
+  """
+
+  columns = ('ids', 'purpose', 'attributes', 'landmarks', 'bboxes')
+
+  def __init__(self, ids = None, purpose = None, attributes = None, landmarks = None, bboxes = None):
+    self.ids = ids
+    self.purpose = purpose
+    self.attributes = attributes
+    self.landmarks = landmarks
+    self.bboxes = bboxes
+    self._clear()
+
+  def _clear(self):
+    """Clears all data that is derived from the columns"""
+    self._offset = None
+    self._order = None
+    self._index = None
+    self._partitions = {}
+    self._files = {}
+    self._statistics = {}
+
+  def __len__(self):
+    return 0 if self.ids is None else len(self.ids)
+
+  def set_column(self, name, ids, values):
+    """Sets the column with the given ``name`` to the given ``values``, which belong to the given file ``ids``.
+    The values are re-ordered to the rows of this table, if required."""
+    import numpy
+    ids = numpy.asarray(ids)
+    if self.ids is None:
+      self.ids = ids
+    elif not numpy.array_equal(self.ids, ids):
+      if len(ids) != len(self.ids):
+        raise ValueError("The %d %s do not match the %d files of the protocol" % (len(ids), name, len(self.ids)))
+      ordered = numpy.empty_like(values)
+      ordered[self.rows(ids)] = values
+      values = ordered
+    setattr(self, name, values)
+    self._clear()
+
+  def _id_offset(self):
+    """Returns the id of the first row, if the ids are consecutive, otherwise ``False``"""
+    import numpy
+    if self._offset is None:
+      ids = self.ids
+      consecutive = len(ids) > 0 and int(ids[-1]) - int(ids[0]) == len(ids) - 1 and bool(numpy.all(numpy.diff(ids) == 1))
+      self._offset = int(ids[0]) if consecutive else False
+      if not consecutive:
+        self._sorted_ids = self.ids[self.order()]
+    return self._offset
+
+  def order(self):
+    """Returns the rows of this table sorted by file id"""
+    import numpy
+    if self._order is None:
+      if len(self.ids) < 2 or numpy.all(self.ids[1:] > self.ids[:-1]):
+        self._order = numpy.arange(len(self.ids))
+      else:
+        self._order = numpy.argsort(self.ids, kind='mergesort')
+      self._order.flags.writeable = False
+    return self._order
+
+  def purpose_rows(self, purposes):
+    """Returns the read-only array of rows for the given purpose codes, sorted by file id.
+    The rows are computed once per combination of purposes."""
+    import numpy
+    key = tuple(sorted(set(purposes)))
+    if key not in self._partitions:
+      order = self.order()
+      rows = order[numpy.isin(self.purpose[order], key)]
+      rows.flags.writeable = False
+      self._partitions[key] = rows
+    return self._partitions[key]
+
+  def files(self, purposes):
+    """Returns the tuple of :py:class:`File` objects for the given purpose codes, sorted by file id.
+    The tuple is created once per combination of purposes."""
+    key = tuple(sorted(set(purposes)))
+    if key not in self._files:
+      with _lock:
+        if key not in self._files:
+          self._files[key] = tuple(self.file(row) for row in self.purpose_rows(key))
+    return self._files[key]
+
+  def row(self, file_id):
+    """Returns the row of the given file id; raises a :py:class:`KeyError` if the file id is unknown"""
+    offset = self._id_offset()
+    if offset is not False:
+      row = int(file_id) - offset
+      if 0 <= row < len(self.ids):
+        return row
+      raise KeyError(file_id)
+    return int(self.rows([file_id])[0])
+
+  def _lookup(self, file_ids):
+    """Returns the rows of the given file ids, and a mask of the file ids that are unknown"""
+    import numpy
+    file_ids = numpy.asarray(file_ids, dtype=numpy.int64)
+    offset = self._id_offset()
+    if offset is not False:
+      rows = file_ids - offset
+      invalid = (rows < 0) | (rows >= len(self.ids))
+    else:
+      positions = numpy.minimum(numpy.searchsorted(self._sorted_ids, file_ids), len(self.ids) - 1)
+      rows = self.order()[positions]
+      invalid = self.ids[rows] != file_ids
+    return rows, invalid
+
+  def rows(self, file_ids):
+    """Returns the rows of the given file ids as an array; raises a :py:class:`KeyError` if any of the file ids is unknown"""
+    import numpy
+    rows, invalid = self._lookup(file_ids)
+    if numpy.any(invalid):
+      raise KeyError(numpy.asarray(file_ids)[invalid][0])
+    return rows
+
+  def contains(self, file_ids):
+    """Returns a boolean array that indicates, which of the given file ids are part of this table"""
+    return ~self._lookup(file_ids)[1]
+
+  def attribute_statistics(self, purposes):
+    """Returns the statistics of the attributes of the given purpose codes as a dictionary with the following read-only entries:
+
+    * ``count``: the number of files
+    * ``positives``: the (40,) number of files with each attribute
+    * ``frequencies``: the (40,) relative frequency of each attribute
+    * ``cooccurrence``: the (40,40) number of files with both attributes, where the diagonal contains the ``positives``
+
+    The statistics are computed once per combination of purposes.
+    """
+    import numpy
+    key = tuple(sorted(set(purposes)))
+    if key not in self._statistics:
+      positive = (self.attributes[self.purpose_rows(key)] == 1).astype(numpy.float32)
+      cooccurrence = numpy.rint(numpy.dot(positive.T, positive)).astype(numpy.int64)
+      count = len(positive)
+      self.set_attribute_statistics(key, {
+        'count' : numpy.array(count),
+        'positives' : numpy.diag(cooccurrence).copy(),
+        'frequencies' : numpy.diag(cooccurrence) / float(max(count, 1)),
+        'cooccurrence' : cooccurrence,
+      })
+    return self._statistics[key]
+
+  def set_attribute_statistics(self, purposes, statistics):
+    """Sets the given (e.g., cached) ``statistics`` of the given purpose codes, see :py:meth:`attribute_statistics`"""
+    for value in statistics.values():
+      value.flags.writeable = False
+    self._statistics[tuple(sorted(set(purposes)))] = statistics
+
+  def attribute_index(self):
+    """Returns the :py:class:`bob.db.celeba.bitmap.AttributeIndex` of this table, which is built on first request"""
+    if self._index is None:
+      with _lock:
+        if self._index is None:
+          from .bitmap import AttributeIndex
+          self._index = AttributeIndex(self)
+    return self._index
+
+  def file(self, row):
+    """Returns the :py:class:`File` for the given row"""
+    return File(int(self.ids[row]), purpose_names[self.purpose[row]])
+
+  def annotation(self, row):
+    """Returns the :py:class:`Annotation` for the given row, which includes the bounding box, if the ``bboxes`` are loaded"""
+    return Annotation(int(self.ids[row]), self.landmarks[row], None if self.bboxes is None else self.bboxes[row])
+
+  def attribute(self, row):
+    """Returns the :py:class:`Attributes` for the given row"""
+    return Attributes(int(self.ids[row]), self.attributes[row])
+
+
+class _RowMapping(Mapping):
+  """A read-only dictionary from file id to objects, which are created by ``view(row)`` when they are requested"""
+  def __init__(self, table, view):
+    self._table = table
+    self._view = view
+
+  def __getitem__(self, file_id):
+    return self._view(self._table.row(file_id))
+
+  def __contains__(self, file_id):
+    try:
+      self._table.row(file_id)
+      return True
+    except (KeyError, ValueError, TypeError):
+      return False
+
+  def __iter__(self):
+    return iter(self._table.ids.tolist())
+
+  def __len__(self):
+    return len(self._table)
+
+
+def _resource(name):
+  """Returns the path of the given resource file of this package.
+  As the package is not zip-safe, resources are located next to this module, and no installed distributions need to be scanned."""
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+# the default protocol source, see :py:mod:`bob.db.celeba.sources`, which can be replaced by setting the ``BOB_DB_CELEBA_PROTOCOL`` environment variable
+protocol_file = os.environ.get('BOB_DB_CELEBA_PROTOCOL') or _resource(os.path.join("data", "protocol.tar.bz2"))
+# the protocol source of the in-the-wild images, i.e., the 'list_landmarks_celeba.txt' and 'list_bbox_celeba.txt' of the original release, in which the landmarks are given in the coordinates of the in-the-wild images;
+# it is not shipped with this package, but it can be set with the ``BOB_DB_CELEBA_WILD_PROTOCOL`` environment variable
+wild_protocol_file = os.environ.get('BOB_DB_CELEBA_WILD_PROTOCOL') or None
+# the indexed SQLite database of the protocol, which is written by ``bob_dbmanage.py celeba create``
+sqlite_file = _resource("db.sql3")
+# the directory of the binary protocol cache, see :py:mod:`bob.db.celeba.cache`; set to ``None`` to disable the cache
+cache_directory = os.environ.get('BOB_DB_CELEBA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'bob.db.celeba')) or None
+# the table of the default protocol source
+table = CelebATable()
+purpose_names = ("training", "validation", "test")
+# the image variants: the aligned and cropped images of 'img_align_celeba', or the original images of 'img_celeba'
+variants = ("aligned", "wild")
+
+# guards the loading of the protocol and the creation of the derived data of the table
+_lock = threading.RLock()
+
+def _reset_lock():
+  """Replaces the lock in a forked child process, as it might have been held by another thread of the parent"""
+  global _lock
+  _lock = threading.RLock()
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=_reset_lock)
+
+# the values of all valid tokens of two characters, e.g., b' 1', b'-1' or b'42', indexed by their little-endian 16-bit code; invalid tokens are marked by :py:data:`_invalid_token`
+_token_values = None
+_invalid_token = -32768
+
+def _two_character_values():
+  """Returns the table :py:data:`_token_values`, which is computed at first use"""
+  import numpy
+  global _token_values
+  if _token_values is None:
+    values = numpy.full(1 << 16, _invalid_token, dtype=numpy.int16)
+    digits = numpy.arange(10)
+    for first in b' -0123456789':
+      codes = first | ((digits + ord('0')) << 8)
+      values[codes] = digits if first == ord(' ') else -digits if first == ord('-') else (first - ord('0')) * 10 + digits
+    _token_values = values
+  return _token_values
+
+def _parse_token(chars, start, end):
+  """Parses the values in the given character columns, in which each value is right-aligned; returns ``None`` if any of the values is invalid"""
+  import numpy
+  result = numpy.zeros(len(chars), dtype=numpy.int64)
+  negative = numpy.zeros(len(chars), dtype=bool)
+  previous_minus = negative
+  for c in numpy.ascontiguousarray(chars[:, start:end].T):
+    digit = (c >= ord('0')) & (c <= ord('9'))
+    minus = c == ord('-')
+    # spaces and minus signs are only allowed before the digits, and a minus sign only directly before them
+    if numpy.any(previous_minus & ~digit) or not numpy.all(digit | ((minus | (c == ord(' '))) & (result == 0))):
+      return None
+    result = result * 10 + numpy.where(digit, c - ord('0'), 0)
+    negative |= minus
+    previous_minus = minus
+  if not numpy.all(digit):
+    return None
+  return numpy.where(negative, -result, result)
+
+def _parse_fixed_width(data, offset, columns, dtype):
+  """Parses the lines that start at the given byte ``offset`` of ``data`` as a character matrix, if all lines have the same length and each value is right-aligned in the same character columns in all lines.
+  Returns the (N,) file ids and the (N, columns) values of the given ``dtype``, or ``None`` if the lines are not laid out like that."""
+  import numpy
+  width = data.find(b'\n', offset) + 1 - offset
+  name_end = data.find(b' ', offset) - offset
+  if width <= 0 or not 0 < name_end < width or (len(data) - offset) % width:
+    return None
+  chars = numpy.frombuffer(data, dtype=numpy.uint8, offset=offset).reshape(-1, width)
+  extension = os.path.splitext(data[offset:offset + name_end])[1]
+
+  # the columns that are blank in all lines separate the values; the extension of the file names and the line ends are treated as blank
+  blank = numpy.all(chars == ord(' '), axis=0)
+  if not numpy.all(chars[:, -1] == ord('\n')):
+    return None
+  blank[-1] = True
+  if extension:
+    if not numpy.all(chars[:, name_end - len(extension):name_end] == numpy.frombuffer(extension, dtype=numpy.uint8)):
+      return None
+    blank[name_end - len(extension):name_end] = True
+
+  # the first and last+1 column of the file id and of each value
+  padded = numpy.concatenate(([True], blank, [True]))
+  starts = numpy.flatnonzero(padded[:-1] & ~padded[1:])
+  ends = numpy.flatnonzero(~padded[:-1] & padded[1:])
+  if len(starts) != columns + 1 or starts[0] != 0:
+    return None
+
+  ids = _parse_token(chars, starts[0], ends[0])
+  if ids is None:
+    return None
+  values = numpy.empty((len(chars), columns), dtype=dtype)
+
+  # values of up to two characters are looked up by the code of their last two characters, which include a blank column for values of a single character;
+  # if these values are equally spaced, they are looked up at once
+  short = numpy.flatnonzero(ends[1:] - starts[1:] <= 2)
+  steps = numpy.unique(numpy.diff(ends[1:][short]))
+  if len(short) and len(steps) <= 1:
+    codes = numpy.ndarray((len(chars), len(short)), dtype='<u2', buffer=data, offset=offset + ends[1:][short[0]] - 2, strides=(width, steps[0] if len(steps) else 1))
+    lookup = _two_character_values()[codes]
+    if numpy.any(lookup == _invalid_token):
+      return None
+    if short[-1] - short[0] + 1 == len(short):
+      # assigning a slice is much faster than assigning a list of columns
+      values[:, short[0]:short[-1]+1] = lookup
+    else:
+      values[:, short] = lookup
+  else:
+    short = ()
+
+  for k in range(columns):
+    if k not in short:
+      value = _parse_token(chars, starts[k+1], ends[k+1])
+      if value is None:
+        return None
+      values[:, k] = value
+  return ids, values
+
+def _parse_list(name, data, columns, dtype, header):
+  """Parses the content of the protocol member with the given ``name``, in which each line consists of a file name and ``columns`` integral values.
+  If the member has a ``header``, its first line contains the number of files, and its second line the names of the columns.
+  The whole content is converted at once, and the number of lines and columns is checked once per member.
+  Returns the (N,) file ids and the (N, columns) values of the given ``dtype``."""
+  import numpy
+  offset, count = 0, None
+  if header:
+    offset = data.index(b'\n') + 1
+    count = int(data[:offset])
+    offset = data.index(b'\n', offset) + 1
+
+  parsed = _parse_fixed_width(data, offset, columns, dtype)
+  if parsed is None:
+    # lines of different lengths are tokenized by NumPy, after removing the extension of the file names
+    body = data[offset:].rstrip()
+    lines = body.count(b'\n') + 1
+    extension = os.path.splitext(body.split(None, 1)[0])[1]
+    try:
+      values = numpy.fromstring(body.replace(extension, b' ') if extension else body, dtype=numpy.int64, sep=' ')
+    except ValueError:
+      values = None
+    if values is None or values.size != lines * (columns + 1):
+      raise ValueError("The protocol member '%s' does not contain %d integral values in each of its %d lines" % (name, columns + 1, lines))
+    values = values.reshape(lines, columns + 1)
+    parsed = values[:, 0], values[:, 1:].astype(dtype)
+
+  ids, values = parsed
+  if count is not None and len(ids) != count:
+    raise ValueError("The protocol member '%s' contains %d instead of %d lines" % (name, len(ids), count))
+  return ids.astype(numpy.int32), values
+
+def _read_files(f, table):
+  """Reads 'list_eval_partition.txt' into the ``purpose`` column of the given ``table``"""
+  import numpy
+  ids, purposes = _parse_list('list_eval_partition.txt', f.read(), 1, numpy.int8, header=False)
+  table.set_column('purpose', ids, purposes[:, 0])
+
+def _read_annotations(f, table):
+  """Reads 'list_landmarks_celeba.txt' into the ``landmarks`` column of the given ``table``"""
+  import numpy
+  ids, landmarks = _parse_list('list_landmarks_celeba.txt', f.read(), 10, numpy.int16, header=True)
+  table.set_column('landmarks', ids, landmarks)
+
+def _read_attributes(f, table):
+  """Reads 'list_attr_celeba.txt' into the ``attributes`` column of the given ``table``"""
+  import numpy
+  ids, attributes = _parse_list('list_attr_celeba.txt', f.read(), 40, numpy.int8, header=True)
+  table.set_column('attributes', ids, attributes)
+
+def _read_bboxes(f, table):
+  """Reads 'list_bbox_celeba.txt' into the ``bboxes`` column of the given ``table``"""
+  import numpy
+  ids, bboxes = _parse_list('list_bbox_celeba.txt', f.read(), 4, numpy.int16, header=True)
+  table.set_column('bboxes', ids, bboxes)
+
+# the members of the protocol file, the functions to read them, and the columns of the table that they fill
+protocol_members = ('list_eval_partition.txt', 'list_landmarks_celeba.txt', 'list_attr_celeba.txt')
+# the members of the protocol sources of the in-the-wild images, see :py:data:`wild_protocol_file`
+wild_members = ('list_landmarks_celeba.txt', 'list_bbox_celeba.txt')
+_member_readers = {
+  'list_eval_partition.txt' : _read_files,
+  'list_landmarks_celeba.txt' : _read_annotations,
+  'list_attr_celeba.txt' : _read_attributes,
+  'list_bbox_celeba.txt' : _read_bboxes,
+}
+_member_columns = {
+  'list_eval_partition.txt' : 'purpose',
+  'list_landmarks_celeba.txt' : 'landmarks',
+  'list_attr_celeba.txt' : 'attributes',
+  'list_bbox_celeba.txt' : 'bboxes',
+}
+
+# the tables of the protocol sources other than the :py:data:`protocol_file`, and of the protocol sources of the in-the-wild images, by their absolute path
+_source_tables = {}
+_wild_tables = {}
+
+def _source(source, wild = False):
+  """Returns the table, the path, the cache directory and the members of the given protocol source.
+  For the default sources, ``None`` refers to the :py:data:`protocol_file`.
+  The ``wild`` sources contain the :py:data:`wild_members` only, and ``None`` refers to the :py:data:`wild_protocol_file`."""
+  if wild:
+    source = source or wild_protocol_file
+    if source is None:
+      raise ValueError("The annotations of the in-the-wild images require a protocol source, e.g., set by the BOB_DB_CELEBA_WILD_PROTOCOL environment variable")
+    tables, subdirectory, members = _wild_tables, 'wild', wild_members
+  elif source is None or os.path.abspath(source) == os.path.abspath(protocol_file):
+    return table, protocol_file, cache_directory, protocol_members
+  else:
+    tables, subdirectory, members = _source_tables, 'sources', protocol_members
+  source = os.path.abspath(source)
+  source_table = tables.get(source)
+  if source_table is None:
+    with _lock:
+      source_table = tables.setdefault(source, CelebATable())
+  directory = None
+  if cache_directory is not None:
+    import hashlib
+    directory = os.path.join(cache_directory, subdirectory, hashlib.sha1(source.encode('utf-8')).hexdigest()[:16])
+  return source_table, source, directory, members
+
+def _loaded_members(table):
+  return set(m for m, c in _member_columns.items() if getattr(table, c) is not None)
+
+def _read_cache(table, source, directory):
+  """Fills all columns of the given ``table`` from the binary cache in the given ``directory``, if it is up-to-date with the protocol ``source``.
+  Returns ``True`` if the cache could be used."""
+  from . import cache
+  if not cache.is_valid(directory, source):
+    return False
+  arrays = cache.read(directory)
+  for column in table.columns[1:]:
+    if column in arrays:
+      table.set_column(column, arrays['ids'], arrays[column])
+  return True
+
+def _write_cache(table, source, directory):
+  """Writes all columns of the given ``table`` into the binary cache in the given ``directory``; failures are logged, but otherwise ignored."""
+  from . import cache
+  try:
+    cache.write(directory, source, {c : getattr(table, c) for c in table.columns})
+  except (IOError, OSError) as e:
+    cache.logger.warning("Could not write the binary cache to '%s': %s", directory, e)
+
+def load_protocol(members = None, source = None, wild = False):
+  """Reads the given members of the protocol source in a single pass through the archive.
+
+  The archive is opened in streaming mode, i.e., it is decompressed sequentially, and reading stops as soon as all requested members have been read.
+  Hence, members that are stored behind the requested ones are never decompressed.
+  Members that have been loaded before are not read again.
+  This function is thread-safe, i.e., concurrent calls read each member only once.
+
+  If the :py:data:`cache_directory` is set, all members of the source are loaded at once: from the binary cache, if it is up-to-date, otherwise from the protocol file, after which the cache is (re-)built.
+  When reading fails, the table of the source is left unchanged.
+
+  Keyword parameters:
+
+  ``members`` : str or [str] or ``None``
+    The members of the protocol file to read, see :py:data:`protocol_members`, or :py:data:`wild_members` for the ``wild`` sources.
+    If ``None``, all members of the source are read in one go.
+
+  ``source`` : str or ``None``
+    The protocol source to read, see :py:mod:`bob.db.celeba.sources`; each source has its own table and cache.
+    If ``None``, the :py:data:`protocol_file` is read into the :py:data:`table`, or the :py:data:`wild_protocol_file` for the ``wild`` sources.
+
+  ``wild`` : bool
+    Read the annotations of the in-the-wild images from a source that contains the :py:data:`wild_members` only.
+  """
+  source_table, source, directory, source_members = _source(source, wild)
+  if members is None:
+    members = source_members
+  elif isinstance(members, str):
+    members = (members,)
+
+  for member in members:
+    if member not in source_members:
+      raise ValueError("Invalid protocol member '%s'. Valid values are %s" % (member, source_members))
+
+  if set(members) <= _loaded_members(source_table):
+    return source_table
+
+  with _lock:
+    _load_members(set(members) - _loaded_members(source_table), source_table, source, directory, source_members)
+  return source_table
+
+def _load_members(pending, table, source, directory, source_members):
+  """Loads the given pending protocol members of the given ``source`` into the given ``table``; the :py:data:`_lock` must be held.
+  The members are read into a copy of the table, which replaces the columns of the ``table`` only after all members have been read."""
+  pending = pending - _loaded_members(table)
+  if not pending:
+    return
+  staging = CelebATable(*(getattr(table, c) for c in table.columns))
+
+  if directory is not None:
+    if _read_cache(staging, source, directory):
+      pending -= _loaded_members(staging)
+    if pending:
+      # read everything, so that the cache can be built
+      pending = set(source_members) - _loaded_members(staging)
+
+  if pending:
+    from .sources import members
+    for name, f in members(source, pending):
+      _member_readers[name](f, staging)
+      pending.remove(name)
+      if not pending:
+        break
+
+    if pending:
+      raise IOError("Could not find %s in the protocol source '%s'" % (sorted(pending), source))
+
+    if directory is not None:
+      _write_cache(staging, source, directory)
+
+  for column in table.columns:
+    setattr(table, column, getattr(staging, column))
+  table._clear()
+
+def preload(attribute_index = True, source = None):
+  """Loads all tables of the protocol, and creates all data derived from them.
+
+  Call this function before forking worker processes (e.g., the workers of a data loader), so that the tables are read only once and shared by the workers copy-on-write.
+
+  Keyword parameters:
+
+  ``attribute_index`` : bool
+    Also build the bitmap index used by :py:meth:`bob.db.celeba.Database.query`.
+
+  ``source`` : str or ``None``
+    The protocol source to load, see :py:func:`load_protocol`.
+  """
+  with _lock:
+    table = load_protocol(source = source)
+    table.row(int(table.ids[0]))
+    for purpose in range(len(purpose_names)):
+      table.files((purpose,))
+    if attribute_index:
+      table.attribute_index()
+
+def get_attribute_statistics(purposes, source = None):
+  """Returns the attribute statistics of the given purpose codes of the given protocol source, see :py:meth:`CelebATable.attribute_statistics`.
+  If the :py:data:`cache_directory` is set, the statistics are stored next to the binary protocol cache."""
+  table = load_protocol(('list_eval_partition.txt', 'list_attr_celeba.txt'), source)
+  directory = _source(source)[2]
+  key = tuple(sorted(set(purposes)))
+  if key in table._statistics or directory is None:
+    return table.attribute_statistics(key)
+
+  from . import cache
+  name = '-'.join(purpose_names[p] for p in key)
+  statistics = cache.read_statistics(directory, name)
+  if statistics is not None:
+    table.set_attribute_statistics(key, statistics)
+    return statistics
+
+  statistics = table.attribute_statistics(key)
+  try:
+    cache.write_statistics(directory, name, statistics)
+  except (IOError, OSError, ValueError, KeyError) as e:
+    cache.logger.warning("Could not write the attribute statistics to '%s': %s", directory, e)
+  return statistics
+
+def get_table(members = None, source = None, wild = False):
+  """Returns the table of the given protocol source (by default, the :py:data:`table`), after the given protocol ``members`` (see :py:func:`load_protocol`) have been loaded"""
+  return load_protocol(members, source, wild)
 
 def get_files():
-  """Reads the 'list_eval_partition.txt' from the protocol file"""
-  if not files_list:
-    tar = tarfile.open(protocol_file, 'r')
-    f = tar.extractfile('list_eval_partition.txt')
-    # read the lines
-    for line in f:
-      splits = line.rstrip().split()
-      assert len(splits) == 2, splits
-
-      # create file
-      file = File(_file_id(splits[0]), purpose_names[int(splits[1])])
-      files_list.append(file)
-  return files_list
+  """Reads the 'list_eval_partition.txt' from the protocol file and returns the list of all :py:class:`File` objects"""
+  load_protocol('list_eval_partition.txt')
+  # the File objects are created once, and shared with :py:meth:`bob.db.celeba.Database.objects`
+  return list(table.files(range(len(purpose_names))))
 
 def get_annotations():
-  """Reads the 'list_landmarks_celeba.txt' from the protocol file"""
-  if not annotations_dict:
-    tar = tarfile.open(protocol_file, 'r')
-    f = tar.extractfile('list_landmarks_celeba.txt')
-    # ignore the first two lines
-    _ = f.readline()
-    _ = f.readline()
-    # read the rest of the lines
-    for line in f:
-      splits = line.rstrip().split()
-      assert len(splits) == 11, splits
-
-      # create annotation
-      annotation = Annotation(_file_id(splits[0]), [int(s) for s in splits[1:]])
-      annotations_dict[annotation.file_id] = annotation
-  return annotations_dict
+  """Reads the 'list_landmarks_celeba.txt' from the protocol file and returns a dictionary from file id to :py:class:`Annotation`"""
+  load_protocol('list_landmarks_celeba.txt')
+  return _RowMapping(table, table.annotation)
 
 def get_attributes():
-  """Reads the 'list_attr_celeba.txt' from the protocol file"""
-  if not attributes_dict:
-    tar = tarfile.open(protocol_file, 'r')
-    f = tar.extractfile('list_attr_celeba.txt')
-    # ignore the first two lines
-    _ = f.readline()
-    _ = f.readline()
-    # read the rest of the lines
-    for line in f:
-      splits = line.rstrip().split()
-      assert len(splits) == 41, splits
-
-      # create attributes
-      attributes = Attributes(_file_id(splits[0]), [int(s) for s in splits[1:]])
-      attributes_dict[attributes.file_id] = attributes
-  return attributes_dict
+  """Reads the 'list_attr_celeba.txt' from the protocol file and returns a dictionary from file id to :py:class:`Attributes`"""
+  load_protocol('list_attr_celeba.txt')
+  return _RowMapping(table, table.attribute)
+
+
+# the tables of the SQLite database; the index of each attribute includes the file id, so that filters are evaluated on the indexes only
+sql_tables = (
+  'CREATE TABLE purposes (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+  'CREATE TABLE files (id INTEGER PRIMARY KEY, purpose INTEGER NOT NULL REFERENCES purposes (id))',
+  'CREATE TABLE attributes (file_id INTEGER PRIMARY KEY REFERENCES files (id), %s)' % ', '.join('"%s" INTEGER NOT NULL' % a for a in Attributes.attribute_names),
+  'CREATE TABLE landmarks (file_id INTEGER PRIMARY KEY REFERENCES files (id), %s)' % ', '.join('%s INTEGER NOT NULL' % l for l in Annotation.label_names),
+)
+sql_indexes = (
+  'CREATE INDEX files_purpose ON files (purpose, id)',
+) + tuple('CREATE INDEX "attributes_%s" ON attributes ("%s", file_id)' % (a, a) for a in Attributes.attribute_names)
+
+# the number of ids that are looked up in a single SQL statement; older SQLite versions allow at most 999 parameters per statement
+sql_batch_size = 900
+
+_connections = threading.local()
+
+def connect(filename):
+  """Returns a read-only connection to the given SQLite database.
+  Connections are opened once per thread and process, as SQLite connections cannot be shared between threads or forked processes."""
+  connections = _connections.__dict__.setdefault('connections', {})
+  key = (os.path.abspath(filename), os.getpid())
+  if key not in connections:
+    import sqlite3
+    from urllib.parse import quote
+    if not os.path.exists(filename):
+      raise IOError("The SQLite database '%s' does not exist; create it with 'bob_dbmanage.py celeba create'" % filename)
+    connections[key] = sqlite3.connect('file:%s?mode=ro' % quote(key[0]), uri=True)
+  return connections[key]
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Packed image datasets, which store (optionally aligned or resized) images in a single contiguous ``uint8`` array.
+
+A packed dataset consists of two files:
+
+* ``<name>.npy``: the (N, C, H, W) or (N, H, W) ``uint8`` images, which are opened as a read-only memory map
+* ``<name>.ids.npy``: the (N,) file ids of the images, in the order of the first dimension of the images
+"""
+
+import os
+
+import numpy
+
+from .alignment import warp
+
+
+def _filenames(filename):
+  """Returns the names of the image and the index file of the packed dataset with the given name"""
+  if filename.endswith('.npy'):
+    filename = filename[:-4]
+  return filename + '.npy', filename + '.ids.npy'
+
+
+def _resize(images, size):
+  """Resizes the given batch or list of images to the given ``(height, width)`` with bilinear interpolation; images of a list that differ in size are resized one by one"""
+  if not isinstance(images, numpy.ndarray):
+    if len(set(numpy.shape(i) for i in images)) > 1:
+      return numpy.stack([_resize(image[None], size)[0] for image in images])
+    images = numpy.stack(images)
+  height, width = images.shape[-2:]
+  transforms = numpy.zeros((len(images), 2, 3))
+  transforms[:, 0, 0] = float(height - 1) / max(size[0] - 1, 1)
+  transforms[:, 1, 1] = float(width - 1) / max(size[1] - 1, 1)
+  return warp(images, transforms, size)
+
+
+def pack(db, files, filename, alignment = None, size = None, batch_size = 256, **kwargs):
+  """Loads, optionally aligns or resizes, and writes the images of the given files into a packed dataset.
+
+  Keyword parameters:
+
+  ``db`` : :py:class:`bob.db.celeba.Database`
+    The database, which is used to load the images, see :py:meth:`bob.db.celeba.Database.load_images`.
+
+  ``files`` : [:py:class:`bob.db.celeba.File`]
+    The files to pack.
+
+  ``filename`` : str
+    The name of the packed dataset; the extension ``.npy`` is optional.
+
+  ``alignment`` : :py:class:`bob.db.celeba.FaceAlignment` or ``None``
+    If given, the images are aligned before they are packed.
+
+  ``size`` : (int, int) or ``None``
+    If given, the (aligned) images are resized to the given ``(height, width)``.
+
+  ``batch_size`` : int
+    The number of images that are aligned and written at a time.
+
+  ``kwargs``
+    Further parameters passed to :py:meth:`bob.db.celeba.Database.load_images`.
+
+  Returns the :py:class:`PackedImages` of the written dataset.
+  """
+  image_file, index_file = _filenames(filename)
+  files = list(files)
+  if not files:
+    raise ValueError("There are no files to pack")
+  ids = numpy.array([f.id for f in files], dtype=numpy.int32)
+
+  images = None
+  batch, annotations = [], []
+
+  def _write(start):
+    # the list of images is stacked after the alignment and resizing, so that the images may differ in size
+    data = batch
+    if alignment is not None:
+      data = alignment(data, numpy.stack(annotations))
+    if size is not None:
+      data = _resize(data, size)
+    if not isinstance(data, numpy.ndarray):
+      for offset, image in enumerate(data):
+        if image.shape != images.shape[1:]:
+          raise ValueError("The image of the file %d has shape %s, but %s is expected; use an alignment or a size to pack images of different sizes" % (ids[start + offset], image.shape, images.shape[1:]))
+      data = numpy.stack(data)
+    if data.dtype != numpy.uint8:
+      data = numpy.clip(numpy.round(data), 0, 255).astype(numpy.uint8)
+    if images.shape[1:] != data.shape[1:]:
+      raise ValueError("The images of the files %d to %d have shape %s, but %s is expected; use an alignment or a size to pack images of different sizes" % (ids[start], ids[start + len(data) - 1], data.shape[1:], images.shape[1:]))
+    images[start:start+len(data)] = data
+    del batch[:]
+    del annotations[:]
+
+  # both files are written to temporary files first, which are removed when packing fails
+  temp_image, temp_index = image_file + '.tmp', index_file + '.tmp'
+  try:
+    start = 0
+    for i, (file, image, annotation, _) in enumerate(db.load_images(files, **kwargs)):
+      if images is None:
+        # create the memory map, once the shape of the images is known
+        shape = image.shape
+        if alignment is not None:
+          shape = shape[:-2] + alignment.crop_size
+        if size is not None:
+          shape = shape[:-2] + tuple(size)
+        directory = os.path.dirname(image_file)
+        if directory and not os.path.isdir(directory):
+          os.makedirs(directory)
+        images = numpy.lib.format.open_memmap(temp_image, mode='w+', dtype=numpy.uint8, shape=(len(files),) + shape)
+      batch.append(image)
+      annotations.append(annotation)
+      if len(batch) == batch_size:
+        _write(start)
+        start = i + 1
+    if batch:
+      _write(start)
+
+    images.flush()
+    images = None
+    with open(temp_index, 'wb') as f:
+      numpy.save(f, ids)
+    # the ids are replaced first, so that the images are only published together with their ids
+    os.replace(temp_index, index_file)
+    os.replace(temp_image, image_file)
+  finally:
+    images = None
+    for temp in (temp_image, temp_index):
+      if os.path.exists(temp):
+        os.remove(temp)
+  return PackedImages(filename)
+
+
+class PackedImages:
+  """Read access to a packed dataset, see :py:func:`pack`.
+
+  The images are opened as a read-only memory map, so that reading single images does not copy any data.
+
+  Keyword parameters:
+
+  ``filename`` : str
+    The name of the packed dataset; the extension ``.npy`` is optional.
+  """
+
+  def __init__(self, filename):
+    image_file, index_file = _filenames(filename)
+    self.images = numpy.load(image_file, mmap_mode='r')
+    self.ids = numpy.load(index_file)
+    if len(self.ids) != len(self.images):
+      raise ValueError("The packed dataset '%s' contains %d images, but %d ids" % (image_file, len(self.images), len(self.ids)))
+    self._order = numpy.argsort(self.ids, kind='mergesort')
+    self._sorted_ids = self.ids[self._order]
+
+  def __len__(self):
+    return len(self.ids)
+
+  def rows(self, files_or_ids):
+    """Returns the rows of the given :py:class:`bob.db.celeba.File` objects or file ids; raises a :py:class:`KeyError` for files that are not packed"""
+    if not isinstance(files_or_ids, numpy.ndarray):
+      files_or_ids = [getattr(f, 'id', f) for f in files_or_ids]
+    file_ids = numpy.asarray(files_or_ids, dtype=numpy.int64)
+    positions = numpy.minimum(numpy.searchsorted(self._sorted_ids, file_ids), len(self.ids) - 1)
+    rows = self._order[positions]
+    invalid = self.ids[rows] != file_ids
+    if numpy.any(invalid):
+      raise KeyError(file_ids[invalid][0])
+    return rows
+
+  def __getitem__(self, file_or_id):
+    """Returns the image of the given :py:class:`bob.db.celeba.File` or file id, as a read-only view into the memory map"""
+    return self.images[int(self.rows([file_or_id])[0])]
+
+  def batch(self, files_or_ids):
+    """Returns the images of the given :py:class:`bob.db.celeba.File` objects or file ids, as one array"""
+    return self.images[self.rows(files_or_ids)]
@@ -16,19 +16,66 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 
 from .models import *
-from .driver import Interface
+
+# the stem of the file names, i.e., the file id
+_file_stem = re.compile('[0-9]+')
+
+def path_template(prefix = None, suffix = None):
+  """Returns a format string that turns a file id into a path with the given ``prefix`` directory and ``suffix`` extension, see :py:meth:`File.make_path`"""
+  # escape the prefix and suffix to be used in a format string
+  return os.path.join((prefix or '').replace('%', '%%'), '%06d' + (suffix or '').replace('%', '%%'))
+
+
+def _image_loader():
+  """Returns :py:func:`bob.io.base.load`, which is the default loader of the original images; the ``bob.io.base`` and ``bob.io.image`` packages are optional"""
+  try:
+    import bob.io.base
+    import bob.io.image # registers the image file formats
+  except ImportError:
+    raise ImportError("Loading the original images requires the 'bob.io.base' and 'bob.io.image' packages; please install them, or pass a loader")
+  return bob.io.base.load
+
 
 class Database():
   """Wrapper class for the MNIST database of handwritten digits (http://yann.lecun.com/exdb/mnist/).
   """
 
-  def __init__(self, original_directory = None, original_extension = '.jpg'):
-    """Creates the database"""
+  def __init__(self, original_directory = None, original_extension = '.jpg', sqlite_file = None, protocol_file = None, original_archive = None, variant = 'aligned', wild_protocol_file = None):
+    """Creates the database.
+
+    The ``variant`` selects the images, which are either the ``'aligned'`` images of ``img_align_celeba``, or the original ``'wild'`` images of ``img_celeba``.
+    For the ``'wild'`` variant, the landmarks are given in the coordinates of the original images, and the :py:meth:`annotations` include the bounding boxes of the faces, see :py:meth:`bounding_boxes_batch`.
+    These annotations are read from the ``wild_protocol_file`` (by default, :py:data:`bob.db.celeba.models.wild_protocol_file`), which needs to contain the ``list_landmarks_celeba.txt`` and the ``list_bbox_celeba.txt`` of the in-the-wild images, e.g., the ``Anno`` directory of the original release.
+    The partition and the attributes are identical for both variants, and they are always read from the ``protocol_file``.
+
+    If an ``sqlite_file`` is given (e.g., :py:data:`bob.db.celeba.models.sqlite_file` after running ``bob_dbmanage.py celeba create``), all lookups -- including the batched ones and :py:meth:`paths` and :py:meth:`reverse` -- are answered by indexed SQL queries, without loading the protocol tables into this process.
+    The bitmap :py:meth:`query` and the :py:meth:`attribute_statistics` require the protocol tables, and they are not available in this mode.
+
+    If a ``protocol_file`` is given, the protocol is read from this archive or directory (see :py:mod:`bob.db.celeba.sources`) instead of :py:data:`bob.db.celeba.models.protocol_file`.
+
+    If an ``original_archive`` is given (e.g., the original ``img_align_celeba.zip``), the original images are read from this zip archive instead of the ``original_directory``, see :py:class:`bob.db.celeba.archive.ImageArchive`.
+    """
+    if variant not in variants:
+      raise ValueError("Invalid variant '%s'. Valid values are %s" % (variant, variants))
+    if variant == 'wild':
+      from .models import wild_protocol_file as default_wild_protocol_file
+      wild_protocol_file = wild_protocol_file or default_wild_protocol_file
+      if wild_protocol_file is None:
+        raise ValueError("The 'wild' variant requires a wild_protocol_file with the annotations of the in-the-wild images, or the BOB_DB_CELEBA_WILD_PROTOCOL environment variable")
+      if sqlite_file is not None:
+        raise ValueError("The SQLite database contains the annotations of the 'aligned' variant only")
+
     # initialize members
     self.original_directory = original_directory
     self.original_extension = original_extension
+    self.sqlite_file = sqlite_file
+    self.protocol_file = protocol_file
+    self.original_archive = original_archive
+    self.variant = variant
+    self.wild_protocol_file = wild_protocol_file
 
     self._purpose_dict = {'training':'training', 'world':'training', 'validation':'validation', 'dev':'validation', 'test':'test', 'eval':'test'}
 
@@ -83,6 +130,33 @@ class Database():
     return Attributes.attribute_names
 
 
+  def attribute_statistics(self, purposes = None):
+    """attribute_statistics(self, purposes=None) -> statistics
+
+    Returns the statistics of the attributes for the given purposes, which are computed in a single vectorized pass over the attribute matrix.
+    The statistics are cached in memory and, if enabled, next to the binary protocol cache.
+
+    **Parameters:**
+
+    ``purposes`` : str or [str] or ``None``
+      A purpose or a list of purposes, which might be ``("training", "validation", "test")``, or ``("world", "dev", "eval")``.
+      If ``None``, the full list of purposes will be used.
+
+    **Returns:**
+
+    ``statistics`` : {str : :py:class:`numpy.ndarray`}
+      A dictionary with the (read-only) entries:
+
+      * ``count``: the number of files of the given purposes
+      * ``positives``: the number of files that have each attribute, in the order of :py:meth:`attribute_names`
+      * ``frequencies``: the relative frequency of each attribute
+      * ``cooccurrence``: the (40,40) number of files that have both attributes
+    """
+    self._check_tables("attribute_statistics")
+    purpose_codes = self._check_object_parameters(purposes, None, None)[0]
+    return get_attribute_statistics(purpose_codes, self.protocol_file)
+
+
   def objects(self, purposes = None, with_attributes = None, without_attributes = None):
     """objects(self, purposes=None, with_attributes=None, without_attributes=None) -> files
 
@@ -108,6 +182,40 @@ class Database():
     ``files`` : [:py:class:`File`]
       A list of files for the given purpose(s), where the given attributes are filtered.
     """
+    purpose_codes, with_attributes, without_attributes = self._check_object_parameters(purposes, with_attributes, without_attributes)
+    if self.sqlite_file is not None:
+      return [File(i, purpose_names[p]) for i, p in self._sql_query('files.id, files.purpose', purpose_codes, with_attributes, without_attributes)]
+
+    if with_attributes is None and without_attributes is None:
+      # return a copy of the cached list of files
+      return list(get_table('list_eval_partition.txt', self.protocol_file).files(purpose_codes))
+
+    table, rows = self._object_rows(purpose_codes, with_attributes, without_attributes)
+    return [table.file(row) for row in rows]
+
+
+  def object_ids(self, purposes = None, with_attributes = None, without_attributes = None):
+    """object_ids(self, purposes=None, with_attributes=None, without_attributes=None) -> ids
+
+    Returns the ids of the files that :py:meth:`objects` would return, without creating any :py:class:`File` objects.
+    The parameters are identical to :py:meth:`objects`.
+
+    **Returns:**
+
+    ``ids`` : 1D :py:class:`numpy.ndarray`
+      The sorted file ids for the given purpose(s), where the given attributes are filtered.
+    """
+    import numpy
+    parameters = self._check_object_parameters(purposes, with_attributes, without_attributes)
+    if self.sqlite_file is not None:
+      return numpy.array([row[0] for row in self._sql_query('files.id', *parameters)], dtype=numpy.int32)
+
+    table, rows = self._object_rows(*parameters)
+    return table.ids[rows]
+
+
+  def _check_object_parameters(self, purposes, with_attributes, without_attributes):
+    """Checks the parameters of :py:meth:`objects` and returns the purpose codes and the lists of attributes"""
     purposes = self._check_parameters_for_validity(purposes, "purpose", ("training", "world", "validation", "dev", "test", "eval"))
     purposes = self._update_purposes(purposes)
 
@@ -116,15 +224,113 @@ class Database():
     if without_attributes is not None:
       without_attributes = self._check_parameters_for_validity(without_attributes, "without attribute", self.attribute_names())
 
-    files = [f for f in get_files() if f.purpose_name in purposes]
+    return [purpose_names.index(p) for p in purposes], with_attributes, without_attributes
+
+
+  def _object_rows(self, purpose_codes, with_attributes, without_attributes):
+    """Returns the table and the rows of the files with the given purpose codes and attributes, sorted by file id"""
+    import numpy
+    if with_attributes is None and without_attributes is None:
+      table = get_table('list_eval_partition.txt', self.protocol_file)
+      return table, table.purpose_rows(purpose_codes)
+
+    # read the file list and the attributes in a single pass through the protocol file
+    table = get_table(('list_eval_partition.txt', 'list_attr_celeba.txt'), self.protocol_file)
+    rows = table.purpose_rows(purpose_codes)
 
+    # compute a mask of the selected rows
+    mask = numpy.ones(len(rows), dtype=bool)
     if with_attributes is not None:
-      files = [f for f in files if all(a == 1 for a in self.attributes(f, with_attributes))]
+      columns = [Attributes.attribute_indices[a] for a in with_attributes]
+      mask &= numpy.all(table.attributes[numpy.ix_(rows, columns)] == 1, axis=1)
 
     if without_attributes is not None:
-      files = [f for f in files if all(a == -1 for a in self.attributes(f, without_attributes))]
+      columns = [Attributes.attribute_indices[a] for a in without_attributes]
+      mask &= numpy.all(table.attributes[numpy.ix_(rows, columns)] == -1, axis=1)
+
+    return table, rows[mask]
+
+
+  def _sql_query(self, columns, purpose_codes, with_attributes, without_attributes):
+    """Selects the given columns of the files with the given purpose codes and attributes from the SQLite database, sorted by file id"""
+    conditions = ['files.purpose IN (%s)' % ', '.join('?' * len(purpose_codes))]
+    join = ''
+    if with_attributes is not None or without_attributes is not None:
+      # the attribute names are validated, so they can be quoted safely
+      join = ' JOIN attributes ON attributes.file_id = files.id'
+      conditions.extend('attributes."%s" = 1' % a for a in with_attributes or ())
+      conditions.extend('attributes."%s" = -1' % a for a in without_attributes or ())
+    sql = 'SELECT %s FROM files%s WHERE %s ORDER BY files.id' % (columns, join, ' AND '.join(conditions))
+    return connect(self.sqlite_file).execute(sql, purpose_codes)
 
-    return sorted(files, key = lambda x: x.id)
+
+  def _check_tables(self, method):
+    """Raises a :py:class:`ValueError` if the given method, which requires the protocol tables, is called on a database with an ``sqlite_file``"""
+    if self.sqlite_file is not None:
+      raise ValueError("The %s requires the protocol tables, which are not loaded for a Database with an sqlite_file; create the Database without the sqlite_file to use it" % method)
+
+
+  def _sql_select(self, table, columns, ids):
+    """Yields the given columns of the rows of the given SQL table, whose first column is in the given list of ids.
+    The ids are looked up in chunks of :py:data:`bob.db.celeba.models.sql_batch_size`."""
+    connection = connect(self.sqlite_file)
+    # the column names are fixed, so they can be quoted safely
+    sql = 'SELECT %s FROM %s WHERE "%s" IN (%%s)' % (', '.join('"%s"' % c for c in columns), table, columns[0])
+    for start in range(0, len(ids), sql_batch_size):
+      chunk = ids[start : start + sql_batch_size]
+      for row in connection.execute(sql % ', '.join('?' * len(chunk)), chunk):
+        yield row
+
+
+  def _sql_batch(self, table, columns, files_or_ids, dtype):
+    """Returns the given columns of the given SQL table for the given list of :py:class:`File` objects or array of file ids as a 2D array; raises a :py:class:`KeyError` for unknown ids"""
+    import numpy
+    ids = numpy.asarray(self._ids(files_or_ids), dtype=numpy.int64).ravel().tolist()
+    values = {row[0] : row[1:] for row in self._sql_select(table, ('file_id',) + tuple(columns), sorted(set(ids)))}
+    batch = numpy.empty((len(ids), len(columns)), dtype=dtype)
+    for i, file_id in enumerate(ids):
+      batch[i] = values[file_id]
+    return batch
+
+
+  def _sql_row(self, table, file_id):
+    """Returns the values of the given SQL table for the given file id, without the file id; raises a :py:class:`KeyError` for unknown ids"""
+    row = connect(self.sqlite_file).execute('SELECT * FROM %s WHERE file_id = ?' % table, (file_id,)).fetchone()
+    if row is None:
+      raise KeyError(file_id)
+    return row[1:]
+
+
+  def query(self, expression, purposes = None):
+    """query(self, expression, purposes=None) -> files
+
+    Returns a list of :py:class:`File` objects, whose attributes fulfill the given boolean ``expression``.
+    The expression is evaluated on a precomputed bitmap index of the attributes, see :py:mod:`bob.db.celeba.bitmap` for the full syntax.
+
+    **Parameters:**
+
+    ``expression`` : str
+      The attribute query, e.g., ``"Male & (Goatee | Mustache) & !Young"`` or ``"atleast(2, Bald, Goatee, Mustache)"``.
+
+    ``purposes`` : str or [str] or ``None``
+      A purpose or a list of purposes, which might be ``("training", "validation", "test")``, or ``("world", "dev", "eval")``.
+      If ``None``, the full list of purposes will be used.
+
+    **Returns:**
+
+    ``files`` : [:py:class:`File`]
+      A list of files for the given purpose(s), for which the expression holds.
+    """
+    import numpy
+    purposes = self._check_parameters_for_validity(purposes, "purpose", ("training", "world", "validation", "dev", "test", "eval"))
+    purposes = self._update_purposes(purposes)
+
+    self._check_tables("query")
+    table = get_table(('list_eval_partition.txt', 'list_attr_celeba.txt'), self.protocol_file)
+    index = table.attribute_index()
+    rows = index.rows(index.evaluate(expression) & index.purpose(purposes))
+    rows = rows[numpy.argsort(table.ids[rows], kind='mergesort')]
+    return [table.file(row) for row in rows]
 
 
   def training_set(self):
@@ -164,6 +370,105 @@ class Database():
     return self.objects(purposes = "test")
 
 
+  def iter_epochs(self, purposes = "training", seed = 0, rank = 0, world_size = 1, batch_size = 1, num_epochs = None, start_step = 0, drop_last = False):
+    """iter_epochs(self, purposes="training", seed=0, rank=0, world_size=1, batch_size=1, num_epochs=None, start_step=0, drop_last=False) -> batches
+
+    Iterates over shuffled batches of file ids of the given purposes, epoch after epoch, without creating :py:class:`File` objects.
+    The iteration is reproducible across processes, and it can be resumed from any step.
+    See :py:class:`bob.db.celeba.sampler.EpochSampler` for details on the shuffling and partitioning.
+
+    **Parameters:**
+
+    ``purposes`` : str or [str] or ``None``
+      A purpose or a list of purposes, which might be ``("training", "validation", "test")``, or ``("world", "dev", "eval")``.
+
+    ``seed`` : int
+      The seed of the permutations; the permutation of each epoch depends on the seed and the epoch only.
+
+    ``rank``, ``world_size`` : int
+      The rank of this process and the total number of processes, which get disjoint parts of each epoch.
+
+    ``batch_size`` : int
+      The number of ids per batch.
+
+    ``num_epochs`` : int or ``None``
+      The number of epochs to iterate; iterate infinitely if ``None``.
+
+    ``start_step`` : int
+      The number of batches that have already been processed by this rank, e.g., to resume training.
+
+    ``drop_last`` : bool
+      Drop ids that do not fill all ranks and batches equally, instead of padding the last batches.
+
+    **Yields:**
+
+    ``ids`` : 1D :py:class:`numpy.ndarray`
+      The file ids of the next batch.
+    """
+    from .sampler import EpochSampler
+    sampler = EpochSampler(self.object_ids(purposes), seed=seed, rank=rank, world_size=world_size, batch_size=batch_size, drop_last=drop_last)
+    return sampler.batches(num_epochs=num_epochs, start_step=start_step)
+
+
+  def attribute_sampler(self, attribute_names, purposes = "training", weighting = "balanced", seed = None):
+    """attribute_sampler(self, attribute_names, purposes="training", weighting="balanced", seed=None) -> sampler
+
+    Returns a sampler that draws batches of file ids that are balanced with respect to the given attributes.
+    The pools of ids for each combination of attributes are built once, so that drawing a batch takes time proportional to the batch size.
+
+    **Parameters:**
+
+    ``attribute_names`` : str or [str]
+      The attributes to balance; each combination of these attributes that occurs in the data gets its own pool.
+
+    ``purposes`` : str or [str] or ``None``
+      A purpose or a list of purposes, which might be ``("training", "validation", "test")``, or ``("world", "dev", "eval")``.
+
+    ``weighting`` : str
+      How the pools are weighted, one of ``('balanced', 'inverse', 'natural')``, see :py:class:`bob.db.celeba.sampler.AttributeSampler`.
+
+    ``seed`` : int or ``None``
+      The seed of the random generator.
+
+    **Returns:**
+
+    ``sampler`` : :py:class:`bob.db.celeba.sampler.AttributeSampler`
+      The sampler, whose :py:meth:`bob.db.celeba.sampler.AttributeSampler.batch` draws a batch of ids.
+    """
+    from .sampler import AttributeSampler
+    ids = self.object_ids(purposes)
+    return AttributeSampler(ids, self.attributes_batch(ids, attribute_names), weighting=weighting, seed=seed)
+
+
+  def stratified_split(self, attribute_names, fractions, purposes = "training", seed = None):
+    """stratified_split(self, attribute_names, fractions, purposes="training", seed=None) -> ids
+
+    Splits the files of the given purposes into disjoint parts, such that each combination of the given attributes is distributed with the same ``fractions`` over the parts.
+
+    **Parameters:**
+
+    ``attribute_names`` : str or [str]
+      The attributes to stratify.
+
+    ``fractions`` : [float]
+      The relative sizes of the parts.
+
+    ``purposes`` : str or [str] or ``None``
+      A purpose or a list of purposes, which might be ``("training", "validation", "test")``, or ``("world", "dev", "eval")``.
+
+    ``seed`` : int or ``None``
+      The seed of the random generator.
+
+    **Returns:**
+
+    ``ids`` : [1D :py:class:`numpy.ndarray`]
+      The sorted file ids of each part.
+    """
+    from .sampler import stratified_split
+    ids = self.object_ids(purposes)
+    return stratified_split(ids, self.attributes_batch(ids, attribute_names), fractions, seed=seed)
+
+
   def original_file_name(self, file):
     """original_file_name(self, file) -> image_name
 
@@ -183,6 +488,326 @@ class Database():
     return file.make_path(self.original_directory, self.original_extension)
 
 
+  def _image_archive(self):
+    """Returns the :py:class:`bob.db.celeba.archive.ImageArchive` of the ``original_archive``"""
+    from .archive import open_archive
+    return open_archive(self.original_archive)
+
+
+  def original_data(self, file):
+    """original_data(self, file) -> data
+
+    Returns the encoded original image of the given file.
+    The image is read from the ``original_archive``, if it was specified in the constructor of this class, otherwise from the :py:meth:`original_file_name`.
+
+    **Parameters:**
+
+    ``file`` : :py:class:`File`
+      The file object to get the original image for.
+
+    **Returns:**
+
+    ``data`` : bytes
+      The content of the original image file.
+    """
+    if self.original_archive is not None:
+      return self._image_archive().read(file.id)
+    with open(self.original_file_name(file), 'rb') as f:
+      return f.read()
+
+
+  def original_size(self, file):
+    """original_size(self, file) -> size
+
+    Returns the size in bytes of the encoded original image of the given file, see :py:meth:`original_data`.
+    """
+    if self.original_archive is not None:
+      return self._image_archive().size(file.id)
+    return os.path.getsize(self.original_file_name(file))
+
+
+  def paths(self, ids, prefix = None, suffix = None):
+    """paths(self, ids, prefix=None, suffix=None) -> paths
+
+    Returns a full file paths considering particular file ids, a given directory and an extension.
+    The paths are generated for the whole array of ids at once, without creating :py:class:`File` objects.
+
+    **Parameters:**
+
+    ``ids`` : [int] or array_like
+      The ids of the object in the database table "file".
+      Ids that are not part of the database are omitted.
+
+    ``prefix`` : str or ``None``
+      The bit of path to be prepended to the filename stem.
+
+    ``suffix`` : str or ``None``
+      The extension determines the suffix that will be appended to the filename stem.
+
+    **Returns:**
+
+    ``paths`` : [str]
+      A list of file paths, in the same order as the (valid) ``ids``.
+    """
+    import numpy
+    ids = numpy.asarray(ids, dtype=numpy.int64).ravel()
+    if self.sqlite_file is not None:
+      known = set(row[0] for row in self._sql_select('files', ('id',), numpy.unique(ids).tolist()))
+      ids = numpy.array([i for i in ids.tolist() if i in known], dtype=numpy.int64)
+    else:
+      ids = ids[get_table('list_eval_partition.txt', self.protocol_file).contains(ids)]
+    template = path_template(prefix, suffix)
+    return [template % i for i in ids.tolist()]
+
+
+  def reverse(self, paths):
+    """reverse(self, paths) -> files
+
+    Reverses the lookup of :py:meth:`paths`: returns the :py:class:`File` objects for the given paths or path stems.
+    Directories and extensions of the paths are ignored.
+
+    **Parameters:**
+
+    ``paths`` : str or [str]
+      The paths or path stems to look up, e.g., ``'000001'`` or ``'/path/to/000001.jpg'``.
+      Paths that are not part of the database are omitted.
+
+    **Returns:**
+
+    ``files`` : [:py:class:`File`]
+      A list of files, in the same order as the (valid) ``paths``.
+    """
+    if isinstance(paths, str):
+      paths = (paths,)
+    ids = []
+    for path in paths:
+      stem = os.path.basename(path).split('.', 1)[0]
+      # str.isdigit() also accepts other unicode digits, which int() cannot parse
+      if _file_stem.fullmatch(stem):
+        ids.append(int(stem))
+
+    if self.sqlite_file is not None:
+      purposes = dict(self._sql_select('files', ('id', 'purpose'), sorted(set(ids))))
+      return [File(i, purpose_names[purposes[i]]) for i in ids if i in purposes]
+
+    table = get_table('list_eval_partition.txt', self.protocol_file)
+    rows, invalid = table._lookup(ids)
+    return [table.file(row) for row in rows[~invalid]]
+
+
+  def _annotation_table(self):
+    """Returns the table that contains the annotations of the variant, i.e., the landmarks and, for the ``'wild'`` variant, the bounding boxes"""
+    if self.variant == 'wild':
+      return get_table(wild_members, self.wild_protocol_file, wild = True)
+    return get_table('list_landmarks_celeba.txt', self.protocol_file)
+
+
+  def _ids(self, files_or_ids):
+    """Returns the file ids of the given list of :py:class:`File` objects or array of file ids"""
+    import numpy
+    if not isinstance(files_or_ids, numpy.ndarray):
+      files_or_ids = [f.id if isinstance(f, File) else f for f in files_or_ids]
+    return files_or_ids
+
+
+  def _rows(self, table, files_or_ids):
+    """Returns the rows of the given list of :py:class:`File` objects or array of file ids"""
+    return table.rows(self._ids(files_or_ids))
+
+
+  def annotations_batch(self, files_or_ids):
+    """annotations_batch(self, files_or_ids) -> annotations
+
+    Returns the annotations for a whole batch of files at once.
+    The coordinates are in the same order as :py:meth:`annotations`, i.e., in ``(y,x)`` order and subject perspective.
+
+    **Parameters:**
+
+    ``files_or_ids`` : [:py:class:`File`] or [int]
+      The file objects or the file ids to get the annotations for.
+
+    **Returns:**
+
+    ``annotations`` : 3D :py:class:`numpy.ndarray` of shape (B, 5, 2)
+      The ``(y,x)`` coordinates of ``('reye', 'leye', 'nose', 'rmouth', 'lmouth')`` for each of the ``B`` files.
+    """
+    import numpy
+    if self.sqlite_file is not None:
+      landmarks = self._sql_batch('landmarks', [Annotation.label_names[c] for c in Annotation.annotation_columns], files_or_ids, numpy.int16)
+    else:
+      table = self._annotation_table()
+      landmarks = table.landmarks[numpy.ix_(self._rows(table, files_or_ids), Annotation.annotation_columns)]
+    return landmarks.reshape(len(landmarks), len(Annotation.annotation_names), 2)
+
+
+  def bounding_boxes_batch(self, files_or_ids):
+    """bounding_boxes_batch(self, files_or_ids) -> bounding_boxes
+
+    Returns the bounding boxes of the faces in the in-the-wild images for a whole batch of files at once.
+    Bounding boxes are only available for the ``'wild'`` variant.
+
+    **Parameters:**
+
+    ``files_or_ids`` : [:py:class:`File`] or [int]
+      The file objects or the file ids to get the bounding boxes for.
+
+    **Returns:**
+
+    ``bounding_boxes`` : 3D :py:class:`numpy.ndarray` of shape (B, 2, 2)
+      The ``(y,x)`` coordinates of the ``('topleft', 'bottomright')`` corners of the bounding boxes of the ``B`` files, as in :py:meth:`annotations`.
+    """
+    import numpy
+    if self.variant != 'wild':
+      raise ValueError("Bounding boxes are only available for the 'wild' variant")
+    table = self._annotation_table()
+    rows = self._rows(table, files_or_ids)
+    # x_1, y_1, width, height -> (y_1, x_1), (y_1 + height, x_1 + width)
+    topleft = table.bboxes[numpy.ix_(rows, (1, 0))].astype(numpy.int32)
+    return numpy.stack((topleft, topleft + table.bboxes[numpy.ix_(rows, (3, 2))]), axis=1)
+
+
+  def attributes_batch(self, files_or_ids, attribute_names = None):
+    """attributes_batch(self, files_or_ids, attribute_names=None) -> attributes
+
+    Returns the attributes for a whole batch of files at once.
+
+    **Parameters:**
+
+    ``files_or_ids`` : [:py:class:`File`] or [int]
+      The file objects or the file ids to get the attributes for.
+
+    ``attribute_names`` : str or [str] or ``None``
+      The list of attribute names which should be retrieved, in the desired order.
+      If ``None``, all attributes are returned.
+
+    **Returns:**
+
+    ``attributes`` : 2D :py:class:`numpy.ndarray` of shape (B, K) and type ``int8``
+      The attributes of the ``B`` files, which are either +1 or -1.
+    """
+    import numpy
+    if attribute_names is not None:
+      attribute_names = self._check_parameters_for_validity(attribute_names, "attribute name", Attributes.attribute_names)
+    if self.sqlite_file is not None:
+      return self._sql_batch('attributes', Attributes.attribute_names if attribute_names is None else attribute_names, files_or_ids, numpy.int8)
+
+    table = get_table('list_attr_celeba.txt', self.protocol_file)
+    rows = self._rows(table, files_or_ids)
+    if attribute_names is None:
+      return table.attributes[rows]
+    return table.attributes[numpy.ix_(rows, [Attributes.attribute_indices[a] for a in attribute_names])]
+
+
+  def load_images(self, files, num_workers = None, prefetch = None, processes = False, loader = None, crop = False, margin = 0., size = None):
+    """load_images(self, files, num_workers=None, prefetch=None, processes=False, loader=None, crop=False, margin=0., size=None) -> iterator
+
+    Loads the original images of the given files in a pool of workers.
+    The images are yielded in the order of the given files, and at most ``prefetch`` images are decoded ahead of the consumer, which bounds the memory usage.
+    This function requires that the ``original_directory`` or the ``original_archive`` was specified in the constructor of this class.
+
+    For the ``'wild'`` variant, the faces can be cropped while the images are decoded, see :py:mod:`bob.db.celeba.crop`.
+
+    **Parameters:**
+
+    ``files`` : [:py:class:`File`]
+      The file objects to load the images for.
+
+    ``num_workers`` : int or ``None``
+      The number of workers that decode images in parallel; by default, the number of CPUs.
+
+    ``prefetch`` : int or ``None``
+      The maximum number of images that are loaded ahead; by default, twice the number of workers.
+
+    ``processes`` : bool
+      Decode images in a pool of processes instead of threads.
+      In this case, the ``loader`` needs to be picklable.
+
+    ``loader`` : callable or ``None``
+      The function that loads an image from its file name; by default, :py:func:`bob.io.base.load` is used, which requires the optional ``bob.io.base`` and ``bob.io.image`` packages.
+      When the images are read from the ``original_archive``, the function receives a file object instead, and by default, :py:func:`bob.db.celeba.archive.decode` is used.
+      When the images are cropped, they are always decoded with :py:func:`bob.db.celeba.crop.decode_crop`.
+
+    ``crop`` : bool
+      Crop the faces to their bounding boxes (``'wild'`` variant only).
+
+    ``margin`` : float
+      The margin that is added on each side of the bounding boxes, relative to their height and width.
+
+    ``size`` : (int, int) or ``None``
+      If given, the crops are resized to this ``(height, width)``; JPEG images are then decoded at a reduced scale, when possible.
+
+    **Yields:**
+
+    ``(file, image, annotations, attributes)`` : (:py:class:`File`, :py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`)
+      The file, its decoded image, its (5, 2) annotations as in :py:meth:`annotations_batch` and its attributes as in :py:meth:`attributes_batch`.
+      When the images are cropped, the annotations are given as floating point coordinates in the cropped images.
+    """
+    import collections
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    files = list(files)
+    annotations = self.annotations_batch(files)
+    attributes = self.attributes_batch(files)
+
+    if crop:
+      import functools
+      from .crop import crop_boxes, crop_annotations, decode_crop
+      if loader is not None:
+        raise ValueError("Cropped images are decoded by bob.db.celeba.crop.decode_crop; a loader cannot be used")
+      boxes = crop_boxes(self.bounding_boxes_batch(files), margin)
+      annotations = crop_annotations(annotations, boxes, size)
+      # the crop of each file is passed to the decoder, which needs to be picklable for process pools
+      loaders = {file.id : functools.partial(decode_crop, box=tuple(box), size=size) for file, box in zip(files, boxes.tolist())}
+    elif self.original_archive is None and loader is None:
+      loader = _image_loader()
+    get_loader = (lambda file: loaders[file.id]) if crop else (lambda file: loader)
+
+    if self.original_archive is not None:
+      from .archive import load_image
+      archive = self._image_archive()
+      task = lambda file: (load_image, archive, file.id, get_loader(file))
+    else:
+      task = lambda file: (get_loader(file), self.original_file_name(file))
+    num_workers = num_workers or multiprocessing.cpu_count()
+    prefetch = max(prefetch or 2 * num_workers, 1)
+
+    executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=num_workers)
+    try:
+      pending = collections.deque()
+      submitted = 0
+      for i, file in enumerate(files):
+        # keep up to ``prefetch`` images in flight
+        while submitted < len(files) and len(pending) < prefetch:
+          pending.append(executor.submit(*task(files[submitted])))
+          submitted += 1
+        yield file, pending.popleft().result(), annotations[i], attributes[i]
+    finally:
+      for future in pending:
+        future.cancel()
+      executor.shutdown(wait=True)
+
+
+  def open_packed(self, filename):
+    """open_packed(self, filename) -> packed
+
+    Opens a packed image dataset, which was written with ``bob_dbmanage.py celeba pack`` or :py:func:`bob.db.celeba.packed.pack`.
+    Images are read from the packed dataset without copying.
+
+    **Parameters:**
+
+    ``filename`` : str
+      The name of the packed dataset.
+
+    **Returns:**
+
+    ``packed`` : :py:class:`bob.db.celeba.packed.PackedImages`
+      The packed images, which can be indexed with :py:class:`File` objects or file ids.
+    """
+    from .packed import PackedImages
+    return PackedImages(filename)
+
+
   def annotations(self, file):
     """annotations(self, file) -> annotations
 
@@ -202,9 +827,13 @@ class Database():
 
     ``annotations`` : {}
       The dictionary of annotations, which include the coordinated for 'reye', 'leye', 'nose', 'rmouth', 'lmouth'.
+      For the ``'wild'`` variant, it also includes the 'topleft' and 'bottomright' corners of the bounding box of the face.
     """
-    annotations = get_annotations()[file.id]
-    return annotations()
+    if self.sqlite_file is not None:
+      return Annotation(file.id, self._sql_row('landmarks', file.id))()
+
+    table = self._annotation_table()
+    return table.annotation(table.row(file.id))()
 
 
   def attributes(self, file, attribute_names=None):
@@ -230,5 +859,8 @@ class Database():
     if attribute_names is not None:
       attribute_names = self._check_parameters_for_validity(attribute_names, "attribute name", Attributes.attribute_names)
 
-    attribute = get_attributes()[file.id]
-    return attribute(attribute_names)
+    if self.sqlite_file is not None:
+      return Attributes(file.id, self._sql_row('attributes', file.id))(attribute_names)
+
+    table = get_table('list_attr_celeba.txt', self.protocol_file)
+    return table.attribute(table.row(file.id))(attribute_names)
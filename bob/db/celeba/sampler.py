@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Samplers that draw batches of file ids without creating :py:class:`bob.db.celeba.File` objects."""
+
+import numpy
+
+
+class EpochSampler:
+  """Deterministic, shuffled iteration over a fixed set of file ids, partitioned over several ranks.
+
+  In each epoch, the ids are permuted with a random generator that is seeded with ``(seed, epoch)``, so that all ranks (and resumed runs) use the same permutation.
+  The permuted ids are padded by repeating ids from the start of the permutation (or truncated, if ``drop_last`` is set), so that all ranks get the same number of ids, and each rank takes every ``world_size``'th id.
+
+  Keyword parameters:
+
+  ``ids`` : array_like
+    The file ids to sample from.
+
+  ``seed`` : int
+    The seed of the permutations.
+
+  ``rank``, ``world_size`` : int
+    The rank of this process and the total number of processes.
+
+  ``batch_size`` : int
+    The number of ids per batch.
+
+  ``drop_last`` : bool
+    Drop the ids that do not fill all ranks equally, and the last incomplete batch of each epoch.
+  """
+
+  def __init__(self, ids, seed = 0, rank = 0, world_size = 1, batch_size = 1, drop_last = False):
+    if not 0 <= rank < world_size:
+      raise ValueError("Invalid rank %d of %d processes" % (rank, world_size))
+    if batch_size < 1:
+      raise ValueError("Invalid batch size %d" % batch_size)
+    self.ids = numpy.asarray(ids)
+    self.seed = seed
+    self.rank = rank
+    self.world_size = world_size
+    self.batch_size = batch_size
+    self.drop_last = drop_last
+
+    if drop_last:
+      self.ids_per_rank = len(self.ids) // world_size
+      self.steps_per_epoch = self.ids_per_rank // batch_size
+    else:
+      self.ids_per_rank = -(-len(self.ids) // world_size)
+      self.steps_per_epoch = -(-self.ids_per_rank // batch_size)
+
+  def epoch(self, epoch):
+    """Returns the ids of this rank for the given epoch"""
+    permutation = numpy.random.RandomState([self.seed, epoch]).permutation(len(self.ids))
+    total = self.ids_per_rank * self.world_size
+    if total > len(permutation):
+      permutation = numpy.resize(permutation, total)
+    return self.ids[permutation[self.rank:total:self.world_size]]
+
+  def batches(self, num_epochs = None, start_step = 0):
+    """Yields the batches of ids for the given number of epochs (infinitely, if ``None``), starting at the given global ``start_step``"""
+    if self.steps_per_epoch == 0:
+      return
+    epoch, step = divmod(start_step, self.steps_per_epoch)
+    while num_epochs is None or epoch < num_epochs:
+      ids = self.epoch(epoch)
+      for start in range(step * self.batch_size, self.steps_per_epoch * self.batch_size, self.batch_size):
+        yield ids[start:start+self.batch_size]
+      epoch, step = epoch + 1, 0
+
+
+def _pools(ids, attributes):
+  """Groups the ids by their combination of attributes.
+  Returns the ids sorted by combination, the combination codes, and the start and number of ids of each pool."""
+  attributes = numpy.asarray(attributes)
+  if attributes.shape[1] > 62:
+    raise ValueError("At most 62 attributes can be combined")
+  codes = numpy.zeros(len(ids), dtype=numpy.int64)
+  for j in range(attributes.shape[1]):
+    codes |= (attributes[:, j] == 1).astype(numpy.int64) << j
+  order = numpy.argsort(codes, kind='mergesort')
+  combinations, starts, counts = numpy.unique(codes[order], return_index=True, return_counts=True)
+  return numpy.asarray(ids)[order], combinations, starts, counts
+
+
+class AttributeSampler:
+  """Draws batches of file ids that are balanced with respect to the given attributes.
+
+  The ids are grouped once into pools, one for each combination of the given attributes that occurs in the data, e.g., two pools for a single attribute.
+  Each id of a batch is drawn by selecting a pool and then an id from that pool, which takes constant time per id.
+  The probability of selecting a pool depends on the ``weighting``:
+
+  * ``'balanced'``: all pools are selected with the same probability
+  * ``'inverse'``: each id has a weight that is the sum of the inverse frequencies of its attribute values, i.e., rare values of any attribute are drawn more often
+  * ``'natural'``: pools are selected proportionally to their size, i.e., ids are drawn uniformly
+
+  Keyword parameters:
+
+  ``ids`` : array_like (N,)
+    The file ids to sample from.
+
+  ``attributes`` : array_like (N, K)
+    The ``+1``/``-1`` values of the ``K`` attributes to balance for each id, e.g., from :py:meth:`bob.db.celeba.Database.attributes_batch`.
+
+  ``weighting`` : str
+    One of ``('balanced', 'inverse', 'natural')``, see above.
+
+  ``seed`` : int or ``None``
+    The seed of the random generator.
+  """
+
+  weightings = ('balanced', 'inverse', 'natural')
+
+  def __init__(self, ids, attributes, weighting = 'balanced', seed = None):
+    if weighting not in self.weightings:
+      raise ValueError("Invalid weighting '%s'. Valid values are %s" % (weighting, self.weightings))
+    attributes = numpy.asarray(attributes)
+    if attributes.ndim == 1:
+      attributes = attributes[:, None]
+    if len(attributes) != len(ids) or not len(ids):
+      raise ValueError("Expected one row of attributes for each of the %d ids, but got %d" % (len(ids), len(attributes)))
+
+    self.ids, self.combinations, self.starts, self.counts = _pools(ids, attributes)
+
+    if weighting == 'balanced':
+      weights = numpy.ones(len(self.counts))
+    elif weighting == 'natural':
+      weights = self.counts.astype(numpy.float64)
+    else:
+      # the frequencies of the positive values of the attributes, and the values of the attributes for each pool;
+      # attributes that are constant in the selection have the same value in all pools, so they are ignored
+      positive = (attributes == 1).mean(axis=0)
+      varying = numpy.flatnonzero((positive > 0) & (positive < 1))
+      values = (self.combinations[:, None] >> varying) & 1
+      frequencies = numpy.where(values == 1, positive[varying], 1. - positive[varying])
+      weights = self.counts * (1. / frequencies).sum(axis=1) if len(varying) else self.counts.astype(numpy.float64)
+    self.probabilities = weights / weights.sum()
+    self.random = numpy.random.RandomState(seed)
+
+  def batch(self, batch_size):
+    """Draws a batch of ``batch_size`` ids (with replacement)"""
+    pools = self.random.choice(len(self.counts), size=batch_size, p=self.probabilities)
+    offsets = (self.random.random_sample(batch_size) * self.counts[pools]).astype(numpy.int64)
+    return self.ids[self.starts[pools] + offsets]
+
+  def batches(self, batch_size, num_batches = None):
+    """Yields the given number of batches (infinitely, if ``None``)"""
+    drawn = 0
+    while num_batches is None or drawn < num_batches:
+      yield self.batch(batch_size)
+      drawn += 1
+
+
+def stratified_split(ids, attributes, fractions, seed = None):
+  """Splits the given ids into disjoint parts of the given ``fractions``, such that each combination of the given attributes is distributed over the parts with the same fractions.
+
+  As each combination of attributes is split separately, only few attributes should be combined; otherwise, most combinations occur only once.
+
+  Keyword parameters:
+
+  ``ids`` : array_like (N,)
+    The file ids to split.
+
+  ``attributes`` : array_like (N, K)
+    The ``+1``/``-1`` values of the ``K`` attributes to stratify for each id.
+
+  ``fractions`` : [float]
+    The relative sizes of the parts, which are normalized to sum up to one.
+
+  ``seed`` : int or ``None``
+    The seed of the random generator that shuffles the ids within each combination.
+
+  Returns a list of sorted id arrays, one for each fraction.
+  """
+  attributes = numpy.asarray(attributes)
+  if attributes.ndim == 1:
+    attributes = attributes[:, None]
+  fractions = numpy.asarray(fractions, dtype=numpy.float64)
+  fractions = fractions / fractions.sum()
+  random = numpy.random.RandomState(seed)
+  sorted_ids, _, starts, counts = _pools(ids, attributes)
+
+  # each part gets the ids of one interval of [0,1); the ids of a pool are placed equidistantly into [0,1) with a random offset,
+  # so that each part gets the rounded up or down share of each pool, and the exact share on average
+  bounds = numpy.cumsum(fractions)[:-1]
+  parts = [[] for _ in fractions]
+  for start, count in zip(starts, counts):
+    pool = sorted_ids[start:start+count][random.permutation(count)]
+    assignment = numpy.searchsorted(bounds, (numpy.arange(count) + random.random_sample()) / count, side='right')
+    for p, part in enumerate(parts):
+      part.append(pool[assignment == p])
+  return [numpy.sort(numpy.concatenate(p)) for p in parts]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sharded export of the CelebA images for distributed training.
+
+Each purpose is written into a number of tar files (shards) of balanced size.
+Each sample in a shard consists of two consecutive members:
+
+* ``<id>.jpg``: the original image bytes
+* ``<id>.json``: a dictionary with the ``purpose``, the 40 ``attributes`` and the 5 ``annotations`` in ``(y,x)`` order, see :py:meth:`bob.db.celeba.Database.annotations_batch`
+
+A ``manifest.json`` lists all shards with their purpose, number of samples and size.
+"""
+
+import os
+import io
+import json
+import heapq
+import tarfile
+
+import numpy
+
+manifest_name = 'manifest.json'
+
+
+def balance(sizes, num_shards):
+  """Distributes items of the given ``sizes`` to ``num_shards`` shards, so that the shards have approximately the same total size.
+  Items are assigned in descending order of their size to the currently smallest shard.
+  Returns a list of ``num_shards`` sorted lists of item indexes."""
+  shards = [[] for _ in range(num_shards)]
+  heap = [(0, s) for s in range(num_shards)]
+  for i in sorted(range(len(sizes)), key = lambda i: -sizes[i]):
+    total, s = heapq.heappop(heap)
+    shards[s].append(i)
+    heapq.heappush(heap, (total + sizes[i], s))
+  return [sorted(s) for s in shards]
+
+
+def _add(tar, name, data):
+  info = tarfile.TarInfo(name)
+  info.size = len(data)
+  tar.addfile(info, io.BytesIO(data))
+
+
+def export(db, files, directory, num_shards):
+  """Writes the images, attributes and annotations of the given files into size-balanced shards.
+
+  Keyword parameters:
+
+  ``db`` : :py:class:`bob.db.celeba.Database`
+    The database; the ``original_directory`` and ``original_extension``, or the ``original_archive`` need to point to the original images, see :py:meth:`bob.db.celeba.Database.original_data`.
+
+  ``files`` : [:py:class:`bob.db.celeba.File`]
+    The files to export; each purpose is written into its own shards.
+
+  ``directory`` : str
+    The directory, where the shards and the manifest are written.
+
+  ``num_shards`` : int
+    The number of shards per purpose.
+
+  Returns the manifest, which is also written to ``manifest.json`` in the given ``directory``.
+  """
+  if num_shards < 1:
+    raise ValueError("The number of shards needs to be positive, but %d was given" % num_shards)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  manifest = {'version' : 1, 'shards' : []}
+  for purpose in ('training', 'validation', 'test'):
+    purpose_files = [f for f in files if f.purpose_name == purpose]
+    if not purpose_files:
+      continue
+    sizes = [db.original_size(f) for f in purpose_files]
+    annotations = db.annotations_batch(purpose_files)
+    attributes = db.attributes_batch(purpose_files)
+
+    for s, indexes in enumerate(balance(sizes, min(num_shards, len(purpose_files)))):
+      name = '%s-%05d.tar' % (purpose, s)
+      with tarfile.open(os.path.join(directory, name + '.tmp'), 'w') as tar:
+        for i in indexes:
+          _add(tar, '%06d.jpg' % purpose_files[i].id, db.original_data(purpose_files[i]))
+          _add(tar, '%06d.json' % purpose_files[i].id, json.dumps({
+            'purpose' : purpose,
+            'attributes' : attributes[i].tolist(),
+            'annotations' : annotations[i].tolist(),
+          }).encode('utf-8'))
+      os.replace(os.path.join(directory, name + '.tmp'), os.path.join(directory, name))
+      manifest['shards'].append({
+        'name' : name,
+        'purpose' : purpose,
+        'count' : len(indexes),
+        'bytes' : sum(sizes[i] for i in indexes),
+      })
+
+  with open(os.path.join(directory, manifest_name), 'w') as f:
+    json.dump(manifest, f, indent=1)
+  return manifest
+
+
+class ShardReader:
+  """Streams the samples of exported shards, see :py:func:`export`.
+
+  The shards of the selected purposes are distributed round-robin over all ``world_size * num_workers`` readers, so that each reader streams a disjoint set of shards sequentially.
+
+  Keyword parameters:
+
+  ``directory`` : str
+    The directory containing the shards and the manifest.
+
+  ``purposes`` : str or [str] or ``None``
+    The purposes to read, from ``('training', 'validation', 'test')``; by default, all purposes are read.
+
+  ``rank``, ``world_size`` : int
+    The rank of this node and the number of nodes.
+
+  ``worker_id``, ``num_workers`` : int
+    The index of this worker on the current node, and the number of workers per node (e.g., of a data loader).
+
+  ``decoder`` : callable or ``None``
+    If given, the image bytes are decoded with this function.
+  """
+
+  def __init__(self, directory, purposes = None, rank = 0, world_size = 1, worker_id = 0, num_workers = 1, decoder = None):
+    with open(os.path.join(directory, manifest_name)) as f:
+      self.manifest = json.load(f)
+    if isinstance(purposes, str):
+      purposes = (purposes,)
+    shards = [s for s in self.manifest['shards'] if purposes is None or s['purpose'] in purposes]
+    if not 0 <= rank < world_size or not 0 <= worker_id < num_workers:
+      raise ValueError("Invalid rank %d of %d or worker %d of %d" % (rank, world_size, worker_id, num_workers))
+    self.directory = directory
+    self.shards = shards[rank * num_workers + worker_id :: world_size * num_workers]
+    self.decoder = decoder
+
+  def __len__(self):
+    """The number of samples that this reader yields"""
+    return sum(s['count'] for s in self.shards)
+
+  def __iter__(self):
+    """Yields ``(file_id, image, attributes, annotations)`` tuples, where the image is either the bytes or the decoded image, the attributes are an ``int8`` array with 40 entries and the annotations a (5,2) array"""
+    for shard in self.shards:
+      with tarfile.open(os.path.join(self.directory, shard['name']), 'r|') as tar:
+        image = None
+        for info in tar:
+          data = tar.extractfile(info).read()
+          stem, extension = os.path.splitext(info.name)
+          if extension == '.jpg':
+            image = data
+          elif extension == '.json':
+            labels = json.loads(data.decode('utf-8'))
+            if self.decoder is not None:
+              image = self.decoder(image)
+            yield int(stem), image, numpy.array(labels['attributes'], dtype=numpy.int8), numpy.array(labels['annotations'])
+            image = None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# @author: Manuel Gunther <siebenkopf@googlemail.com>
+# @date:   Fri Jan 22 09:08:25 MST 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Protocol sources, from which the list files of the protocol are read.
+
+A protocol source is either:
+
+* a tar archive, which might be uncompressed, or compressed with gzip, bzip2, xz or Zstandard (the latter requires the optional ``zstandard`` package), or
+* a directory that contains the list files, e.g., the extracted archive.
+
+The compression of an archive is detected from its first bytes, independent of its file name.
+Further compressions can be supported by adding them to :py:data:`decompressors`.
+"""
+
+import os
+
+
+def _zstandard(f):
+  try:
+    import zstandard
+  except ImportError:
+    raise ImportError("The protocol file '%s' is compressed with Zstandard; please install the 'zstandard' package to read it" % f.name)
+  return zstandard.ZstdDecompressor().stream_reader(f)
+
+# the magic bytes of compressed archives, and functions that wrap the opened archive into a decompressing stream;
+# gzip, bzip2 and xz are detected and decompressed by :py:mod:`tarfile` itself
+decompressors = {
+  b'\x28\xb5\x2f\xfd' : _zstandard,
+}
+
+
+def members(source, names):
+  """Yields ``(name, file)`` tuples for the members of the given protocol ``source`` with the given names, in the order in which they are stored.
+  Archives are read as a stream, so that members stored behind the last requested one are never decompressed, when the iteration is stopped early.
+
+  Keyword parameters:
+
+  ``source`` : str
+    The protocol archive or directory.
+
+  ``names`` : [str]
+    The names of the list files to read; directories inside the archive are ignored.
+  """
+  if os.path.isdir(source):
+    for name in sorted(names):
+      path = os.path.join(source, name)
+      if os.path.isfile(path):
+        with open(path, 'rb') as f:
+          yield name, f
+    return
+
+  import tarfile
+  with open(source, 'rb') as f:
+    magic = f.read(max(len(m) for m in decompressors))
+    f.seek(0)
+    stream = f
+    for m, decompressor in decompressors.items():
+      if magic.startswith(m):
+        stream = decompressor(f)
+    with tarfile.open(fileobj=stream, mode='r|*') as tar:
+      for info in tar:
+        name = os.path.basename(info.name)
+        if name in names:
+          yield name, tar.extractfile(info)
@@ -20,7 +20,40 @@
 
 import bob.db.celeba
 import random
+import numpy
 import os
+import shutil
+import tempfile
+import contextlib
+
+_cache_directory = None
+
+
+def setup_module():
+  # write the binary cache of the protocol into a temporary directory, and not into the home directory of the developer
+  global _cache_directory
+  _cache_directory = bob.db.celeba.models.cache_directory
+  bob.db.celeba.models.cache_directory = tempfile.mkdtemp(prefix='bobtest_')
+
+
+def teardown_module():
+  shutil.rmtree(bob.db.celeba.models.cache_directory, ignore_errors=True)
+  bob.db.celeba.models.cache_directory = _cache_directory
+
+
+@contextlib.contextmanager
+def _temporary_directory(cache = False):
+  """Yields a temporary directory, which is removed afterwards.
+  While the directory is used, the binary cache is written into its ``cache`` subdirectory, or it is disabled."""
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  cache_directory = bob.db.celeba.models.cache_directory
+  bob.db.celeba.models.cache_directory = os.path.join(temp_dir, 'cache') if cache else None
+  try:
+    yield temp_dir
+  finally:
+    bob.db.celeba.models.cache_directory = cache_directory
+    shutil.rmtree(temp_dir)
+
 
 def test_query():
   db = bob.db.celeba.Database()
@@ -98,3 +131,729 @@ def test_file_names():
   for f in o:
     n = db.original_file_name(f)
     assert n == os.path.join("/path/to/files", "%06d.jpg" % f.id)
+
+
+def test_load_protocol():
+  # read all members of the protocol file in one go
+  bob.db.celeba.models.load_protocol()
+  files = bob.db.celeba.models.get_files()
+  assert len(files) == 202599
+  # the File objects are cached, and shared with the objects of the database
+  assert all(a is b for a, b in zip(bob.db.celeba.models.get_files(), files))
+  assert bob.db.celeba.Database().objects()[0] is files[0]
+  assert len(bob.db.celeba.models.get_annotations()) == 202599
+  assert len(bob.db.celeba.models.get_attributes()) == 202599
+
+
+def test_cache():
+  from bob.db.celeba import models, cache
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    table = models.get_table()
+    cache.write(temp_dir, models.protocol_file, {c : getattr(table, c) for c in table.columns})
+    assert cache.is_valid(temp_dir, models.protocol_file)
+    arrays = cache.read(temp_dir)
+    assert isinstance(arrays['attributes'], numpy.memmap)
+    assert arrays['attributes'].shape == (202599, 40)
+    assert arrays['landmarks'].shape == (202599, 10)
+    assert arrays['ids'][0] == 1
+    assert list(arrays['attributes'][0]) == models.get_attributes()[1].attributes
+    assert (arrays['landmarks'] == table.landmarks).all()
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_table():
+  db = bob.db.celeba.Database()
+  table = bob.db.celeba.models.get_table()
+  assert len(table) == 202599
+  assert table.attributes.shape == (202599, 40)
+  assert table.landmarks.shape == (202599, 10)
+
+  # files, annotations and attributes are views into the rows of the table
+  f = table.file(table.row(42))
+  assert f.id == 42
+  assert not hasattr(f, '__dict__')
+  assert table.annotation(table.row(42))() == db.annotations(f)
+  assert table.attribute(table.row(42))() == db.attributes(f)
+  assert list(table.rows([3, 1, 2])) == [2, 0, 1]
+
+
+def test_attribute_filter():
+  db = bob.db.celeba.Database()
+  files = db.objects("validation", with_attributes=["Smiling", "Eyeglasses"], without_attributes="Male")
+  ids = set(f.id for f in files)
+  for f in db.objects("validation"):
+    a = db.attributes(f, ["Smiling", "Eyeglasses", "Male"])
+    assert (f.id in ids) == (a == [1, 1, -1])
+
+
+def test_attribute_expression():
+  db = bob.db.celeba.Database()
+  files = db.query("Sideburns & Attractive & !Young", "training")
+  assert [f.id for f in files] == [f.id for f in db.objects("training", with_attributes=["Sideburns", "Attractive"], without_attributes=["Young"])]
+
+  files = db.query("Male & (Goatee | Mustache) & ~(Young | Bald)", ("dev", "eval"))
+  for f in files:
+    a = dict(zip(db.attribute_names(), db.attributes(f)))
+    assert f.purpose_name in ("validation", "test")
+    assert a["Male"] == 1 and (a["Goatee"] == 1 or a["Mustache"] == 1) and a["Young"] == -1 and a["Bald"] == -1
+
+  at_least = set(f.id for f in db.query("atleast(2, Bald, Goatee, Mustache)"))
+  for f in db.objects():
+    assert (f.id in at_least) == (db.attributes(f, ["Bald", "Goatee", "Mustache"]).count(1) >= 2)
+
+  for invalid in ("Male &", "(Male", "Unknown", "Male Young", "atleast(Male, Young)"):
+    try:
+      db.query(invalid)
+      assert False, invalid
+    except ValueError:
+      pass
+
+
+def test_partitions():
+  db = bob.db.celeba.Database()
+  table = bob.db.celeba.models.get_table()
+
+  # partitions are computed once and sorted by id
+  rows = table.purpose_rows([0])
+  assert rows is table.purpose_rows([0])
+  assert len(rows) == 162770
+  assert (table.ids[rows][1:] > table.ids[rows][:-1]).all()
+
+  # repeated calls return the same files, but in independent lists
+  train = db.training_set()
+  train.reverse()
+  again = db.training_set()
+  assert again[0].id < again[-1].id
+  assert again[0] is train[-1]
+  assert [f.id for f in db.objects(("dev", "eval"))] == sorted(f.id for f in db.validation_set() + db.test_set())
+
+
+def test_preload():
+  import threading
+  bob.db.celeba.preload()
+
+  # concurrent queries see each file exactly once
+  db = bob.db.celeba.Database()
+  lengths = []
+  def query():
+    lengths.append((len(db.objects()), len(db.objects("training", with_attributes="Smiling"))))
+  threads = [threading.Thread(target=query) for _ in range(8)]
+  for t in threads: t.start()
+  for t in threads: t.join()
+  assert len(lengths) == 8
+  assert len(set(lengths)) == 1
+  assert lengths[0][0] == 202599
+
+
+def _checkfiles(report, **kwargs):
+  """Runs the checkfiles command with the given arguments, and returns its JSON report"""
+  import argparse, json
+  from bob.db.celeba.driver import checkfiles
+  args = argparse.Namespace(directory=None, extension='.jpg', verify='exists', jobs=4, batch_size=1000, stat=False, progress=0, report=report, archive=None, selftest=True)
+  vars(args).update(kwargs)
+  assert checkfiles(args) == 0
+  with open(report) as f:
+    return json.load(f)
+
+
+def test_checkfiles():
+  db = bob.db.celeba.Database()
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    # three valid images, an empty file and a file that is not a JPEG
+    images = os.path.join(temp_dir, 'images')
+    os.mkdir(images)
+    files = db.objects("test")[:6]
+    for f, content in zip(files, (b'\xff\xd8\xff\xe0', b'\xff\xd8\xff\xe1', b'\xff\xd8\xff\xdb', b'', b'GIF89a')):
+      with open(f.make_path(images, '.jpg'), 'wb') as image:
+        image.write(content)
+    missing = sorted(set(db.object_ids().tolist()) - set(f.id for f in files[:5]))
+    report = os.path.join(temp_dir, 'report.json')
+
+    # the directory is listed once, or each file is checked individually
+    for stat in (False, True):
+      result = _checkfiles(report, directory=images, stat=stat)
+      assert result['missing'] == missing and result['corrupt'] == []
+      assert result['checked'] == 202599 and result['verify'] == 'exists'
+    result = _checkfiles(report, directory=images, stat=True, verify='size')
+    assert result['missing'] == missing and result['corrupt'] == [files[3].id]
+    # a file that exists, but cannot be read, is corrupt
+    os.mkdir(files[5].make_path(images, '.jpg'))
+    missing.remove(files[5].id)
+    result = _checkfiles(report, directory=images, verify='jpeg', batch_size=7)
+    assert result['missing'] == missing and result['corrupt'] == [f.id for f in files[3:]]
+
+    # directories that cannot be listed are checked file by file
+    assert len(_checkfiles(report, directory=os.path.join(temp_dir, 'unknown'))['missing']) == 202599
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_paths():
+  db = bob.db.celeba.Database()
+  paths = db.paths([1, 202599, 0, 202600, 42], prefix="/path/to/files", suffix=".jpg")
+  assert paths == ["/path/to/files/000001.jpg", "/path/to/files/202599.jpg", "/path/to/files/000042.jpg"]
+  assert db.paths([1, 2]) == ["000001", "000002"]
+
+  files = db.reverse(paths + ["unknown", "999999", "000007", "\u00b2", "00001\u0663.jpg"])
+  assert [f.id for f in files] == [1, 202599, 42, 7]
+  assert files[0].purpose_name == "training"
+
+
+def _dumplist(**kwargs):
+  """Returns the arguments of the dumplist command"""
+  import argparse
+  args = argparse.Namespace(directory=None, extension=None, purpose=None, with_attributes=None, without_attributes=None, format='path', selftest=False)
+  vars(args).update(kwargs)
+  return args
+
+
+def test_dumplist():
+  import subprocess, sys
+  from bob.db.celeba.driver import _listing
+  db = bob.db.celeba.Database()
+  table, rows = db._object_rows(*db._check_object_parameters("dev", "Smiling", "Male"))
+  files = db.objects("dev", with_attributes="Smiling", without_attributes="Male")
+
+  # the chunks do not depend on the chunk size
+  paths = ''.join(_listing(table, rows, "/path/to/files", ".jpg", 'path', chunk_size=7))
+  assert paths == ''.join('/path/to/files/%06d.jpg\n' % f.id for f in files)
+  assert ''.join(_listing(table, rows[:3], None, None, 'null')) == ''.join('%06d\0' % f.id for f in files[:3])
+
+  table = bob.db.celeba.models.get_table()
+  lines = ''.join(_listing(table, rows[:2], "images", ".png", 'csv')).splitlines()
+  assert len(lines) == 3
+  assert lines[0].split(',')[:4] == ['id', 'path', 'purpose', '5_o_Clock_Shadow'] and len(lines[0].split(',')) == 43
+  assert lines[1] == '%d,images/%06d.png,validation,%s' % (files[0].id, files[0].id, ','.join(str(a) for a in db.attributes(files[0])))
+
+  # closing the pipe early does not raise an error
+  environment = dict(os.environ, BOB_DB_CELEBA_PROTOCOL=bob.db.celeba.models.protocol_file, BOB_DB_CELEBA_CACHE=bob.db.celeba.models.cache_directory)
+  process = subprocess.Popen([sys.executable, '-c', 'import argparse, bob.db.celeba.driver; bob.db.celeba.driver.dumplist(argparse.Namespace(**%r))' % vars(_dumplist())], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+  assert process.stdout.readline() == b'000001\n'
+  process.stdout.close()
+  assert process.wait() == 0
+  assert process.stderr.read() == b''
+
+
+def test_object_ids():
+  db = bob.db.celeba.Database()
+  ids = db.object_ids("dev", with_attributes="Smiling", without_attributes="Male")
+  assert list(ids) == [f.id for f in db.objects("dev", with_attributes="Smiling", without_attributes="Male")]
+  assert len(db.object_ids()) == 202599
+
+
+def test_batches():
+  db = bob.db.celeba.Database()
+  files = db.objects("test")[:100]
+
+  annotations = db.annotations_batch(files)
+  assert annotations.shape == (100, 5, 2)
+  for f, a in zip(files, annotations):
+    expected = db.annotations(f)
+    assert [tuple(c) for c in a] == [expected[n] for n in ('reye', 'leye', 'nose', 'rmouth', 'lmouth')]
+
+  attributes = db.attributes_batch([f.id for f in files], ["Young", "Male"])
+  assert attributes.shape == (100, 2)
+  assert attributes.dtype == numpy.int8
+  for f, a in zip(files, attributes):
+    assert list(a) == db.attributes(f, ["Young", "Male"])
+  assert (db.attributes_batch(numpy.array([f.id for f in files])) == [db.attributes(f) for f in files]).all()
+
+
+def _fake_loader(path):
+  return numpy.array([int(os.path.splitext(os.path.basename(path))[0])])
+
+
+def test_load_images():
+  db = bob.db.celeba.Database("/path/to/files")
+  files = db.objects("eval")[:50]
+  for processes in (False, True):
+    loaded = list(db.load_images(files, num_workers=4, prefetch=3, processes=processes, loader=_fake_loader))
+    assert [l[0] for l in loaded] == files
+    assert [l[1][0] for l in loaded] == [f.id for f in files]
+    assert all(l[2].shape == (5, 2) and l[3].shape == (40,) for l in loaded)
+
+  # stop early
+  images = db.load_images(files, num_workers=2, loader=_fake_loader)
+  assert next(images)[0] is files[0]
+  images.close()
+
+  # the default loader requires the optional bob.io.base package
+  import sys
+  module, sys.modules['bob.io.base'] = sys.modules.get('bob.io.base'), None
+  try:
+    next(db.load_images(files))
+    assert False
+  except ImportError as e:
+    assert 'bob.io.base' in str(e)
+  finally:
+    if module is None:
+      del sys.modules['bob.io.base']
+    else:
+      sys.modules['bob.io.base'] = module
+
+
+def test_alignment():
+  from bob.db.celeba.alignment import FaceAlignment
+  alignment = FaceAlignment(crop_size=(80, 64), right_eye=(16, 15), left_eye=(16, 48))
+  images = numpy.random.RandomState(7).randint(0, 256, (3, 3, 218, 178)).astype(numpy.uint8)
+
+  # eyes at the target positions: aligned images are crops of the original images
+  annotations = numpy.zeros((3, 5, 2))
+  annotations[:, 0] = (16 + 10, 15 + 20)
+  annotations[:, 1] = (16 + 10, 48 + 20)
+  aligned = alignment(images, annotations)
+  assert aligned.shape == (3, 3, 80, 64)
+  assert numpy.allclose(aligned, images[:, :, 10:90, 20:84])
+  assert numpy.allclose(alignment(images[:, 0], annotations), images[:, 0, 10:90, 20:84])
+
+  # eyes twice as far apart, and rotated by 90 degrees
+  annotations[:, 0] = (100, 50)
+  annotations[:, 1] = (166, 50)
+  aligned = alignment(images, annotations)
+  assert numpy.allclose(aligned[:, :, 16, 15], images[:, :, 100, 50])
+  assert numpy.allclose(aligned[:, :, 16, 48], images[:, :, 166, 50])
+  assert numpy.allclose(aligned[:, :, 18, 15], images[:, :, 100, 46])
+
+
+def _fake_image(path):
+  # a color image that encodes the file id in the upper left pixel
+  image = numpy.zeros((3, 218, 178), numpy.uint8)
+  image[:, 0, 0] = int(os.path.splitext(os.path.basename(path))[0]) % 256
+  return image
+
+
+def test_packed():
+  db = bob.db.celeba.Database("/path/to/files")
+  files = db.objects("test")[:20]
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    from bob.db.celeba.packed import pack
+    pack(db, files, os.path.join(temp_dir, "packed"), batch_size=8, loader=_fake_image)
+    packed = db.open_packed(os.path.join(temp_dir, "packed.npy"))
+    assert len(packed) == 20
+    assert isinstance(packed.images, numpy.memmap)
+    assert packed.images.shape == (20, 3, 218, 178)
+    assert packed[files[3]][0, 0, 0] == files[3].id % 256
+    assert list(packed.batch([f.id for f in files[5:8]])[:, 1, 0, 0]) == [f.id % 256 for f in files[5:8]]
+
+    # aligned and resized images
+    alignment = bob.db.celeba.FaceAlignment()
+    packed = pack(db, files, os.path.join(temp_dir, "aligned"), alignment=alignment, size=(40, 32), loader=_fake_image)
+    assert packed.images.shape == (20, 3, 40, 32)
+    assert packed.images.dtype == numpy.uint8
+
+    # images of different sizes are packed with an alignment, or resized
+    def loader(path):
+      image = _fake_image(path)
+      return image[:, :200] if int(os.path.basename(path)[:6]) % 2 else image
+    packed = pack(db, files, os.path.join(temp_dir, "different"), alignment=alignment, batch_size=8, loader=loader)
+    assert packed.images.shape == (20, 3, 80, 64)
+    packed = pack(db, files, os.path.join(temp_dir, "different"), size=(40, 32), loader=loader)
+    assert packed.images.shape == (20, 3, 40, 32)
+    # otherwise, packing fails, and the temporary files are removed
+    contents = sorted(os.listdir(temp_dir))
+    try:
+      pack(db, files, os.path.join(temp_dir, "failed"), loader=loader)
+      assert False
+    except ValueError as e:
+      assert 'use an alignment or a size' in str(e)
+    assert sorted(os.listdir(temp_dir)) == contents
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_shards():
+  from bob.db.celeba.shards import export, ShardReader
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    # write fake images of different sizes
+    db = bob.db.celeba.Database(os.path.join(temp_dir, "images"))
+    files = db.objects("training")[:30] + db.objects("test")[:10]
+    os.makedirs(db.original_directory)
+    for f in files:
+      with open(db.original_file_name(f), 'wb') as image:
+        image.write(b'\xff\xd8\xff' * (f.id % 7 + 1))
+
+    manifest = export(db, files, os.path.join(temp_dir, "shards"), 4)
+    assert len(manifest['shards']) == 8
+    assert sum(s['count'] for s in manifest['shards']) == 40
+    training = [s['bytes'] for s in manifest['shards'] if s['purpose'] == 'training']
+    assert max(training) - min(training) <= 21
+    for num_shards in (0, -1):
+      try:
+        export(db, files, os.path.join(temp_dir, "empty"), num_shards)
+        assert False
+      except ValueError:
+        pass
+    # the export command rejects such numbers while parsing the arguments
+    import argparse
+    from bob.db.celeba.driver import _positive_int
+    assert _positive_int('3') == 3
+    try:
+      _positive_int('0')
+      assert False
+    except argparse.ArgumentTypeError:
+      pass
+
+    # each sample is read by exactly one worker of one rank
+    samples = []
+    for rank in range(2):
+      for worker in range(2):
+        samples.extend(ShardReader(os.path.join(temp_dir, "shards"), rank=rank, world_size=2, worker_id=worker, num_workers=2))
+    assert sorted(s[0] for s in samples) == sorted(f.id for f in files)
+    for file_id, image, attributes, annotations in samples:
+      assert len(image) == 3 * (file_id % 7 + 1)
+      assert list(attributes) == db.attributes(db.reverse(["%06d" % file_id])[0])
+      assert annotations.shape == (5, 2)
+
+    reader = ShardReader(os.path.join(temp_dir, "shards"), purposes="test", decoder=len)
+    assert len(reader) == 10
+    assert sorted(s[0] for s in reader) == [f.id for f in files[30:]]
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_iter_epochs():
+  db = bob.db.celeba.Database()
+  ids = set(db.object_ids("validation"))
+
+  # two ranks see all ids of an epoch exactly once (up to padding)
+  batches = [list(db.iter_epochs("dev", seed=3, rank=r, world_size=2, batch_size=100, num_epochs=1)) for r in range(2)]
+  assert len(batches[0]) == len(batches[1]) == 100
+  epoch = numpy.concatenate(batches[0] + batches[1])
+  assert len(epoch) == 19868 and set(epoch) == ids
+
+  # the iteration is reproducible, differs between epochs and can be resumed
+  again = list(db.iter_epochs("dev", seed=3, rank=0, world_size=2, batch_size=100, num_epochs=2))
+  assert all((a == b).all() for a, b in zip(batches[0], again))
+  assert not (again[0] == again[100]).all()
+  resumed = list(db.iter_epochs("dev", seed=3, rank=0, world_size=2, batch_size=100, num_epochs=2, start_step=150))
+  assert len(resumed) == 50 and all((a == b).all() for a, b in zip(again[150:], resumed))
+
+  dropped = list(db.iter_epochs("dev", batch_size=1000, num_epochs=1, drop_last=True))
+  assert len(dropped) == 19 and all(len(b) == 1000 for b in dropped)
+
+
+def test_attribute_sampler():
+  db = bob.db.celeba.Database()
+  sampler = db.attribute_sampler(["Bald", "Male"], seed=5)
+  assert len(sampler.counts) == 4
+
+  batch = sampler.batch(20000)
+  assert len(batch) == 20000
+  attributes = db.attributes_batch(batch, ["Bald", "Male"])
+  codes = (attributes[:, 0] == 1) * 2 + (attributes[:, 1] == 1)
+  assert all(abs(numpy.mean(codes == c) - 0.25) < 0.02 for c in range(4))
+
+  # rare values of attributes are drawn more often
+  sampler = db.attribute_sampler("Bald", weighting="inverse", seed=5)
+  assert abs(numpy.mean(db.attributes_batch(sampler.batch(10000), "Bald") == 1) - 0.5) < 0.03
+
+  # attributes that are constant in the selection are ignored, without warnings
+  from bob.db.celeba.sampler import AttributeSampler
+  import warnings
+  ids = numpy.arange(1, 101)
+  attributes = numpy.stack((numpy.where(ids % 4 == 0, 1, -1), -numpy.ones(100, numpy.int8), numpy.ones(100, numpy.int8)), axis=1)
+  with warnings.catch_warnings():
+    warnings.simplefilter("error")
+    sampler = AttributeSampler(ids, attributes, weighting="inverse", seed=5)
+    assert numpy.allclose(sampler.probabilities, 0.5)
+    sampler = AttributeSampler(ids, attributes[:, 1:], weighting="inverse", seed=5)
+    assert numpy.allclose(sampler.probabilities, 1.)
+
+  parts = db.stratified_split(["Bald", "Smiling"], [0.8, 0.2], purposes="dev", seed=1)
+  assert sum(len(p) for p in parts) == 19867
+  assert not set(parts[0]) & set(parts[1])
+  for a in ("Bald", "Smiling"):
+    frequencies = [numpy.mean(db.attributes_batch(p, a) == 1) for p in parts]
+    assert abs(frequencies[0] - frequencies[1]) < 0.01
+
+
+def test_attribute_statistics():
+  db = bob.db.celeba.Database()
+  statistics = db.attribute_statistics("training")
+  assert statistics['count'] == 162770
+  assert statistics['cooccurrence'].shape == (40, 40)
+  assert (statistics['cooccurrence'] == statistics['cooccurrence'].T).all()
+
+  attributes = db.attributes_batch(db.object_ids("training")) == 1
+  assert list(statistics['positives']) == list(attributes.sum(axis=0))
+  assert numpy.allclose(statistics['frequencies'], attributes.mean(axis=0))
+  male, young = bob.db.celeba.models.Attributes.attribute_indices['Male'], bob.db.celeba.models.Attributes.attribute_indices['Young']
+  assert statistics['cooccurrence'][male, young] == len(db.objects("training", with_attributes=["Male", "Young"]))
+  assert db.attribute_statistics("world") is statistics
+
+
+def test_lazy_imports():
+  import subprocess, sys
+  heavy = ('numpy', 'tarfile', 'bz2', 'pkg_resources', 'bob.db.base.driver', 'bob.db.celeba.driver', 'argparse', 'concurrent.futures')
+  loaded = subprocess.check_output([sys.executable, '-c', 'import sys, bob.db.celeba; print(" ".join(m for m in %r if m in sys.modules))' % (heavy,)])
+  assert loaded.strip() == b'', loaded
+
+
+def test_benchmark():
+  from bob.db.celeba.benchmark import run, save, compare
+  results = run(['objects', 'query', 'annotations_batch', 'memory'], repeat=1, cold=False)
+  assert set(results) >= {'objects', 'query', 'annotations_batch', 'memory_peak'}
+  assert all(v > 0 for v in results.values())
+
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    baseline = os.path.join(temp_dir, 'baseline.json')
+    save(results, baseline)
+    assert compare(results, baseline) == []
+    slower = dict(results, objects = results['objects'] * 2)
+    assert compare(slower, baseline, tolerance=0.5) == ['objects']
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_sqlite():
+  from bob.db.celeba.create import create_sqlite
+  temp_dir = tempfile.mkdtemp(prefix='bobtest_')
+  try:
+    sqlite_file = os.path.join(temp_dir, 'db.sql3')
+    assert create_sqlite(sqlite_file) == 202599
+    db = bob.db.celeba.Database()
+    sql = bob.db.celeba.Database(sqlite_file=sqlite_file)
+
+    assert [(f.id, f.purpose_name) for f in sql.objects("validation")] == [(f.id, f.purpose_name) for f in db.objects("validation")]
+    assert numpy.all(sql.object_ids(["training", "test"], with_attributes=["Sideburns", "Attractive"], without_attributes="Young") == db.object_ids(["training", "test"], with_attributes=["Sideburns", "Attractive"], without_attributes="Young"))
+    for f in random.sample(db.objects(), 100):
+      assert sql.annotations(f) == db.annotations(f)
+      assert sql.attributes(f) == db.attributes(f)
+      assert sql.attributes(f, ["Male", "Young"]) == db.attributes(f, ["Male", "Young"])
+
+    # the batched lookups and the paths do not load the protocol tables
+    sql = bob.db.celeba.Database(sqlite_file=sqlite_file, protocol_file=os.path.join(temp_dir, 'missing'))
+    files = random.sample(db.objects(), 1000)
+    ids = numpy.array([f.id for f in files])
+    assert numpy.array_equal(sql.annotations_batch(files), db.annotations_batch(files))
+    assert numpy.array_equal(sql.attributes_batch(ids), db.attributes_batch(ids))
+    assert numpy.array_equal(sql.attributes_batch(ids, ["Young", "Male"]), db.attributes_batch(ids, ["Young", "Male"]))
+    assert sql.annotations_batch([]).shape == (0, 5, 2)
+    assert sql.paths([3, 0, 1, 300000, 3], suffix='.jpg') == db.paths([3, 0, 1, 300000, 3], suffix='.jpg')
+    assert [(f.id, f.purpose_name) for f in sql.reverse(['/a/000002.jpg', '999999', '182638'])] == [(f.id, f.purpose_name) for f in db.reverse(['/a/000002.jpg', '999999', '182638'])]
+    for function in (lambda: sql.attributes_batch([1, 300000]), lambda: sql.annotations_batch([0])):
+      try:
+        function()
+        assert False
+      except KeyError:
+        pass
+    for function in (lambda: sql.query("Male"), lambda: sql.attribute_statistics()):
+      try:
+        function()
+        assert False
+      except ValueError:
+        pass
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def test_parse_list():
+  from bob.db.celeba.models import _parse_list
+  fixed = b'2\nA B\n000001.jpg -1  1\n000002.jpg 12 -3\n'
+  ragged = b'2\nA B\n000001.jpg -1 1\n000002.jpg 12  -3\n'
+  for data in (fixed, ragged):
+    ids, values = _parse_list('list', data, 2, numpy.int16, header=True)
+    assert ids.tolist() == [1, 2]
+    assert values.tolist() == [[-1, 1], [12, -3]]
+    assert values.dtype == numpy.int16
+
+  for data in (b'000001.jpg 1 2\n000002.jpg 1\n', b'000001.jpg 1 x\n000002.jpg 1 2\n', b'3\nA B\n000001.jpg 1 2\n'):
+    try:
+      _parse_list('list', data, 2, numpy.int8, header=data.startswith(b'3'))
+      assert False, data
+    except ValueError:
+      pass
+
+
+def test_protocol_sources():
+  import tarfile
+  from bob.db.celeba.models import protocol_file, protocol_members
+  # do not cache the temporary sources
+  with _temporary_directory() as temp_dir:
+    # extract the protocol into a directory, and re-compress it with gzip
+    directory = os.path.join(temp_dir, 'protocol')
+    with tarfile.open(protocol_file) as tar:
+      for info in tar:
+        if os.path.basename(info.name) in protocol_members:
+          with open(os.path.join(temp_dir, os.path.basename(info.name)), 'wb') as f:
+            f.write(tar.extractfile(info).read())
+    os.mkdir(directory)
+    gzip_file = os.path.join(temp_dir, 'protocol.tgz')
+    with tarfile.open(gzip_file, 'w:gz', compresslevel=1) as tar:
+      for name in protocol_members:
+        tar.add(os.path.join(temp_dir, name), name)
+        shutil.move(os.path.join(temp_dir, name), directory)
+
+    db = bob.db.celeba.Database()
+    files = random.sample(db.objects(), 1000)
+    for source in (directory, gzip_file):
+      source_db = bob.db.celeba.Database(protocol_file=source)
+      assert len(source_db.objects("validation")) == len(db.objects("validation"))
+      assert numpy.array_equal(source_db.attributes_batch(files), db.attributes_batch(files))
+      assert numpy.array_equal(source_db.annotations_batch(files), db.annotations_batch(files))
+
+
+def _fake_archive_loader(f):
+  return numpy.frombuffer(f.read(), dtype=numpy.uint8)
+
+
+def test_archive():
+  import zipfile, pickle
+  from bob.db.celeba.archive import ImageArchive, open_archive
+  with _temporary_directory(cache=True) as temp_dir:
+    # write fake images into a zip archive, with stored and deflated members
+    db = bob.db.celeba.Database(original_archive=os.path.join(temp_dir, 'images.zip'))
+    files = db.objects("test")[:40]
+    data = {f.id : b'\xff\xd8\xff' + os.urandom(f.id % 13) + b'\0' * 100 for f in files}
+    with zipfile.ZipFile(db.original_archive, 'w') as archive:
+      archive.writestr('img_align_celeba/', b'')
+      for f in files:
+        archive.writestr('img_align_celeba/%06d.jpg' % f.id, data[f.id], zipfile.ZIP_DEFLATED if f.id % 2 else zipfile.ZIP_STORED)
+
+    for f in files:
+      assert db.original_data(f) == data[f.id]
+      assert db.original_size(f) == len(data[f.id])
+    loaded = list(db.load_images(files, num_workers=2, loader=_fake_archive_loader))
+    assert all(image.tobytes() == data[f.id] for f, image, _, _ in loaded)
+    assert os.listdir(os.path.join(temp_dir, 'cache', 'archives'))
+
+    # the index is stored and re-used, and archives are pickled by reference
+    index_file = os.path.join(temp_dir, 'images.npz')
+    archive = ImageArchive(db.original_archive, index_file)
+    assert os.path.exists(index_file) and len(archive) == 40
+    assert numpy.array_equal(ImageArchive(db.original_archive, index_file).offsets, archive.offsets)
+    assert pickle.loads(pickle.dumps(archive)) is open_archive(db.original_archive, index_file)
+    try:
+      archive.read(files[-1].id + 1)
+      assert False
+    except KeyError:
+      pass
+    archive.close()
+
+    # the archive is checked with progress reports
+    import io, sys
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+      report = _checkfiles(os.path.join(temp_dir, 'report.json'), archive=db.original_archive, verify='size', batch_size=10000, progress=5)
+      progress = sys.stderr.getvalue().splitlines()
+    finally:
+      sys.stderr = stderr
+    assert len(report['missing']) == 202599 - 40 and not report['corrupt']
+    assert len(progress) == 4 and progress[-1].startswith('Checked 200000 of 202599 files')
+
+    # the default decoder requires the optional Pillow package
+    module, sys.modules['PIL'] = sys.modules.get('PIL'), None
+    try:
+      bob.db.celeba.archive.decode(io.BytesIO(data[files[0].id]))
+      assert False
+    except ImportError as e:
+      assert 'Pillow' in str(e)
+    finally:
+      if module is None:
+        del sys.modules['PIL']
+      else:
+        sys.modules['PIL'] = module
+
+
+def _write_wild_protocol(directory, db, files):
+  """Writes the protocol source of the in-the-wild images for the given files, which contains the shifted landmarks and made-up bounding boxes only"""
+  table = bob.db.celeba.models.get_table()
+  rows = table.rows([f.id for f in files])
+  names = ['%06d.jpg' % f.id for f in files]
+  def write(name, header, lines):
+    with open(os.path.join(directory, name), 'w') as f:
+      f.write('%d\n%s\n' % (len(lines), header))
+      f.write(''.join(line + '\n' for line in lines))
+  write('list_landmarks_celeba.txt', ' '.join(bob.db.celeba.models.Annotation.label_names), ['%s %s' % (n, ' '.join('%4d' % (l + 100) for l in table.landmarks[r])) for n, r in zip(names, rows)])
+  write('list_bbox_celeba.txt', 'image_id x_1 y_1 width height', ['%s %d 20 200 250' % (n, 10 + i) for i, n in enumerate(names)])
+
+
+def test_wild():
+  models = bob.db.celeba.models
+  with _temporary_directory(cache=True) as temp_dir:
+    db = bob.db.celeba.Database()
+    files = db.objects("test")[:20]
+    anno = os.path.join(temp_dir, 'Anno')
+    os.mkdir(anno)
+    _write_wild_protocol(anno, db, files)
+    assert sorted(os.listdir(anno)) == ['list_bbox_celeba.txt', 'list_landmarks_celeba.txt']
+
+    for cached in (False, True):
+      if cached:
+        # the annotations are read from the binary cache of the source
+        del models._wild_tables[os.path.abspath(anno)]
+        assert len(os.listdir(os.path.join(temp_dir, 'cache', 'wild'))) == 1
+      wild = bob.db.celeba.Database(wild_protocol_file=anno, variant='wild')
+      # the partition and the attributes are read from the default protocol
+      assert [f.id for f in wild.objects("test")] == [f.id for f in db.objects("test")]
+      assert numpy.array_equal(wild.annotations_batch(files), db.annotations_batch(files) + 100)
+      annotations = wild.annotations(files[1])
+      assert annotations['reye'] == tuple(v + 100 for v in db.annotations(files[1])['reye'])
+      assert annotations['topleft'] == (20, 11) and annotations['bottomright'] == (270, 211)
+      boxes = wild.bounding_boxes_batch(files)
+      assert boxes.shape == (20, 2, 2) and boxes[0].tolist() == [[20, 10], [270, 210]]
+      assert wild.attributes_batch(files).tolist() == db.attributes_batch(files).tolist()
+
+    # a source that misses a list leaves its table unchanged
+    incomplete = os.path.join(temp_dir, 'incomplete')
+    os.mkdir(incomplete)
+    shutil.copy(os.path.join(anno, 'list_landmarks_celeba.txt'), incomplete)
+    try:
+      bob.db.celeba.Database(wild_protocol_file=incomplete, variant='wild').annotations_batch(files)
+      assert False
+    except IOError:
+      pass
+    table = models._wild_tables[os.path.abspath(incomplete)]
+    assert all(getattr(table, c) is None for c in table.columns)
+
+    for kwargs in ({'variant' : 'unknown'}, {'variant' : 'wild', 'wild_protocol_file' : anno, 'sqlite_file' : models.sqlite_file}):
+      try:
+        bob.db.celeba.Database(**kwargs)
+        assert False, kwargs
+      except ValueError:
+        pass
+    for function in (lambda: db.bounding_boxes_batch(files), lambda: models.load_protocol('list_attr_celeba.txt', anno, wild=True)):
+      try:
+        function()
+        assert False
+      except ValueError:
+        pass
+
+
+def test_crop():
+  import unittest
+  try:
+    from PIL import Image
+  except ImportError:
+    raise unittest.SkipTest("Pillow is not installed")
+  from bob.db.celeba.crop import crop_boxes, decode_crop
+  with _temporary_directory() as temp_dir:
+    # a smooth image, which survives JPEG compression and downscaling
+    y, x = numpy.mgrid[0:300, 0:400]
+    image = numpy.stack((y * 255 // 299, x * 255 // 399, (x + y) * 255 // 698)).astype(numpy.uint8)
+    Image.fromarray(image.transpose(1, 2, 0)).save(os.path.join(temp_dir, 'image.png'))
+    assert numpy.array_equal(decode_crop(os.path.join(temp_dir, 'image.png'), (20, 10, 270, 210)), image[:, 20:270, 10:210])
+    # regions outside of the image are filled with zeros
+    crop = decode_crop(os.path.join(temp_dir, 'image.png'), (-10, -10, 50, 50))
+    assert crop.shape == (3, 60, 60) and not crop[:, :10].any() and numpy.array_equal(crop[:, 10:, 10:], image[:, :50, :50])
+    assert crop_boxes([[[20, 10], [270, 210]]], 0.1).tolist() == [[-5., -10., 295., 230.]]
+
+    db = bob.db.celeba.Database()
+    files = db.objects("test")[:4]
+    _write_wild_protocol(temp_dir, db, files)
+    for f in files:
+      Image.fromarray(image.transpose(1, 2, 0)).save(os.path.join(temp_dir, '%06d.jpg' % f.id), quality=95)
+    wild = bob.db.celeba.Database(original_directory=temp_dir, wild_protocol_file=temp_dir, variant='wild')
+    for processes in (False, True):
+      loaded = list(wild.load_images(files, num_workers=2, processes=processes, crop=True, size=(25, 20)))
+      for i, (f, crop, annotations, _) in enumerate(loaded):
+        # the JPEG is decoded at 1/8 of its resolution, and the crop is resized to the requested size
+        reference = image[:, 20:270:10, 10+i:210+i:10].astype(numpy.int32)
+        assert crop.shape == (3, 25, 20) and numpy.abs(crop - reference).mean() < 4
+        assert numpy.allclose(annotations, (wild.annotations_batch([f])[0] - (20, 10 + i)) / 10.)
@@ -44,6 +44,11 @@ setup(
     zip_safe=False,
 
     install_requires = install_requires,
+    # decoding the images of zip archives and cropping the in-the-wild images requires Pillow
+    extras_require = {
+      'images' : ['Pillow'],
+    },
+    python_requires = '>=3.5',
 
     entry_points={
       # declare database to bob
@@ -63,6 +68,7 @@ setup(
       'Natural Language :: English',
       'Programming Language :: Python',
       'Programming Language :: Python :: 3',
+      'Programming Language :: Python :: 3 :: Only',
       'Topic :: Scientific/Engineering :: Artificial Intelligence',
       'Topic :: Database :: Front-Ends',
     ],